@@ -1,5 +1,7 @@
 # Main
+import argparse
 import sys
+from multiprocessing import freeze_support
 from pathlib import Path
 from src.Controller import Controller
 
@@ -8,6 +10,17 @@ if sys.version_info < (3, 12):
     sys.exit(1)
 
 if __name__ == "__main__":
+    freeze_support()
+    parser = argparse.ArgumentParser(description="Tabulação e análise do valor adicionado por município.")
+    parser.add_argument('--rebuild-cache', action='store_true', help="descarta o cache de leitura dos CSV e relê todos os arquivos")
+    parser.add_argument('--headless', action='store_true', help="não grava o arquivo Excel (apenas a exportação Parquet, se habilitada)")
+    parser.add_argument('--profile', nargs='?', const='logs/profile.pstats', metavar='ARQUIVO',
+                        help="executa sob cProfile e grava o perfil em ARQUIVO (padrão: logs/profile.pstats) e um resumo em .txt")
+    parser.add_argument('--mun', type=str.upper, metavar='SIGMUN',
+                        help="lê apenas os arquivos SIGMUN_VarAnual-*.csv e regrava só as abas Variacao e Analise do município (ex.: ITG)")
+    args = parser.parse_args()
+
     project_root = Path(__file__).parent
-    controller = Controller(project_root)
+    profile = project_root / args.profile if args.profile else None
+    controller = Controller(project_root, rebuild_cache=args.rebuild_cache, headless=args.headless, profile=profile, sig_mun=args.mun)
     controller.run()
\ No newline at end of file
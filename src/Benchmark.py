@@ -0,0 +1,339 @@
+# Benchmark.py
+import argparse
+import configparser
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from src.Instrumentation import metrics, peak_memory_mb, span
+from src.Model import CSV_ENCODING, CSV_SEPARATOR
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+# Colunas do layout DECLAN após os anos da janela (não usadas pelo modelo, mas presentes em todos os arquivos reais)
+DECLAN_TRAILER = [
+    'DDD_DECLAN', 'Telefone_DECLAN', 'DDD_Fax_DECLAN', 'Fax_DECLAN', 'Email_DECLAN', 'Nome_Representante_DECLAN',
+    'DDD_Representante_DECLAN', 'Telefone_Representante_DECLAN', 'Contador_DECLAN', 'DDD_Contador_DECLAN',
+    'Telefone_Contador_DECLAN', 'Endereco_Obrigados', 'Bairro_Obrigados', 'Cidade_Obrigados', 'Nome_Cidade_Obrigados',
+    'UF_Obrigados', 'Tipo_Logradouro_Municipio', 'Endereco_Municipio', 'Numero_Municipio', 'Complemento_Municipio',
+    'Bairro_Municipio', 'Cidade_Municipio', 'Nome_Cidade_Municipio', 'UF_Municipio', 'CEP_Municipio', 'Email_Municipio',
+    'Telefone_Municipio', 'Nome_Contador', 'Tipo_Logradouro_Contador', 'Endereco_Contador', 'Numero_Contador',
+    'Complemento_Contador', 'Bairro_Contador', 'Cidade_Contador', 'Nome_Cidade_Contador', 'UF_Contador', 'CEP_Contador',
+    'Email_Contador', 'Telefone_Contador'
+]
+# Conteúdo fixo de alguns campos do trecho final, para que a leitura percorra linhas de tamanho realista
+TRAILER_SAMPLE = {'Email_DECLAN': 'contato@empresa.com.br', 'Endereco_Obrigados': 'AVN PRESIDENTE VARGAS 100',
+                  'Bairro_Obrigados': 'CENTRO', 'UF_Obrigados': 'RJ', 'UF_Municipio': 'RJ'}
+WINDOW_YEARS = 3
+EXCEL_MAX_ROWS = 1_048_576
+STAGES = ('ingest', 'dedupe', 'tables', 'variations', 'excel_view', 'data_analyzer')
+
+class SyntheticDataset:
+    def __init__(self, root: Path, municipalities: int, taxpayers: int, first_year: int = 2017, windows: int = 5, seed: int = 0):
+        """Gera em root um projeto completo (entrada DECLAN, Config.ini, mapa de SigMun e modelo Excel) em escala sintética."""
+        # Os municípios reais do TAB_ApoioSigMun.json vêm primeiro (o modelo Excel já tem as suas abas); os demais são fictícios
+        self.root = root
+        self.municipalities = municipalities
+        self.taxpayers = taxpayers
+        self.first_year = first_year
+        self.windows = windows
+        self.rng = np.random.default_rng(seed)
+        self.input_rows = 0
+        self.input_bytes = 0
+
+    def generate(self, overrides: Dict[Tuple[str, str], str], template: bool = True) -> None:
+        """Grava os arquivos do projeto sintético (o modelo Excel apenas se template)."""
+        start_time = time.time()
+        for folder in ('resources', 'data/input', 'data/output'):
+            (self.root / folder).mkdir(parents=True, exist_ok=True)
+        sig_mun_map = self.sig_mun_map()
+        with open(self.root / 'resources' / 'TAB_ApoioSigMun.json', 'w', encoding='utf-8') as f:
+            json.dump(sig_mun_map, f, ensure_ascii=False, indent=2)
+        shutil.copy(PROJECT_ROOT / 'resources' / 'TAB_ApoioTitles.json', self.root / 'resources')
+        config = self.write_config(overrides)
+
+        counts = np.bincount(self.rng.integers(0, len(sig_mun_map), self.taxpayers), minlength=len(sig_mun_map))
+        inscricoes = self.unique_inscricoes()
+        offset = 0
+        for (sig_mun, nome), count in zip(sig_mun_map.items(), counts):
+            self.write_municipio(sig_mun, nome, inscricoes[offset:offset + count])
+            offset += count
+
+        if template:
+            self.prepare_template(config, list(sig_mun_map))
+        logging.info(f"Base sintética gerada em {self.root}: {self.municipalities} municípios, {self.taxpayers} contribuintes, "
+                     f"{self.input_rows} linhas, {self.input_bytes / 2**20:.1f} MB. Tempo: {time.time() - start_time:.2f} segundos")
+
+    def sig_mun_map(self) -> Dict[str, str]:
+        """Mapa SigMun → nome: municípios reais primeiro, completado com municípios fictícios."""
+        with open(PROJECT_ROOT / 'resources' / 'TAB_ApoioSigMun.json', 'r', encoding='utf-8') as f:
+            real = json.load(f)
+        sig_mun_map = dict(list(real.items())[:self.municipalities])
+        idx = 1
+        while len(sig_mun_map) < self.municipalities:
+            sig_mun_map.setdefault(f"M{idx:02d}", f"Municipio Sintetico {idx:02d}")
+            idx += 1
+        return sig_mun_map
+
+    def write_config(self, overrides: Dict[Tuple[str, str], str]) -> configparser.ConfigParser:
+        """Copia o Config.ini do projeto aplicando as substituições (o cache de leitura fica desligado por padrão)."""
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config.read(PROJECT_ROOT / 'resources' / 'Config.ini')
+        config['PERFORMANCE']['IngestCache'] = 'False'
+        for (section, key), value in overrides.items():
+            if section != 'DEFAULT' and not config.has_section(section):
+                config.add_section(section)
+            config[section][key] = value
+        with open(self.root / 'resources' / 'Config.ini', 'w', encoding='utf-8') as f:
+            config.write(f)
+        return config
+
+    def unique_inscricoes(self) -> np.ndarray:
+        """Inscrições estaduais distintas de 8 dígitos (sem zero à esquerda), em ordem aleatória."""
+        drawn = np.unique(self.rng.integers(10_000_000, 100_000_000, int(self.taxpayers * 1.1) + 16))
+        while len(drawn) < self.taxpayers:
+            drawn = np.unique(np.r_[drawn, self.rng.integers(10_000_000, 100_000_000, self.taxpayers)])
+        return self.rng.permutation(drawn)[:self.taxpayers]
+
+    def write_municipio(self, sig_mun: str, nome: str, inscricoes: np.ndarray) -> None:
+        """Grava as janelas de 3 anos de um município; cada contribuinte tem um período de atividade e valores anuais."""
+        count = len(inscricoes)
+        years = self.windows + WINDOW_YEARS - 1
+        # Período de atividade (anos fora dele valem 0) e valores com tendência e ruído
+        start = self.rng.integers(0, years, count)
+        end = np.minimum(years, start + self.rng.integers(1, years + 1, count))
+        base = self.rng.lognormal(11, 2, count)
+        growth = self.rng.normal(1.0, 0.25, (count, years)).cumprod(axis=1)
+        offsets = np.arange(years)
+        values = np.where((offsets >= start[:, None]) & (offsets < end[:, None]), (base[:, None] * growth).round(2), 0.0)
+        # Uma fração dos contribuintes tem valor adicionado negativo em algum ano
+        values[self.rng.random((count, years)) < 0.02] *= -1
+
+        cnpj = self.rng.integers(0, 10**14, count, dtype=np.int64)
+        ids = pd.DataFrame({
+            'Inscricao': inscricoes.astype(str),
+            'CPF_CNPJ': pd.Series(cnpj).map('="{:014d}"'.format),
+            'Nome': pd.Series(np.arange(count)).map(f"EMPRESA SINTETICA {sig_mun} {{:07d}} LTDA".format),
+            'Nome_Cidade': nome
+        })
+        trailer = ';'.join(TRAILER_SAMPLE.get(column, '') for column in DECLAN_TRAILER)
+
+        for window in range(self.windows):
+            first = self.first_year + window
+            columns = values[:, window:window + WINDOW_YEARS]
+            active = (columns != 0).any(axis=1)
+            header = ['Inscricao', 'CPF_CNPJ', 'Nome', 'Nome_Cidade', f"{first}(R$)", 'Variacao_1', f"{first + 1}(R$)",
+                      'Variacao_2', f"{first + 2}(R$)"] + DECLAN_TRAILER
+            table = pd.DataFrame({column: ids.loc[active, column].to_numpy() for column in ids.columns})
+            year_values = columns[active]
+            for idx in range(WINDOW_YEARS):
+                if idx:
+                    table[f"Variacao_{idx}"] = self.decimal_text(year_values[:, idx] - year_values[:, idx - 1])
+                table[str(first + idx)] = self.decimal_text(year_values[:, idx])
+            lines = table.iloc[:, 0].str.cat([table[column] for column in table.columns[1:]], sep=CSV_SEPARATOR)
+            file_path = self.root / 'data' / 'input' / f"{sig_mun}_VarAnual-{first}a{first + WINDOW_YEARS - 1}.csv"
+            with open(file_path, 'w', encoding=CSV_ENCODING, newline='') as f:
+                f.write(CSV_SEPARATOR.join(header) + '\n')
+                if len(lines):
+                    f.write('\n'.join(lines + CSV_SEPARATOR + trailer) + '\n')
+            self.input_rows += len(lines)
+            self.input_bytes += file_path.stat().st_size
+
+    @staticmethod
+    def decimal_text(values: np.ndarray) -> np.ndarray:
+        """Valores com duas casas e vírgula decimal, como nos arquivos DECLAN."""
+        return np.char.replace(np.char.mod('%.2f', values), '.', ',')
+
+    def prepare_template(self, config: configparser.ConfigParser, sig_muns: List[str]) -> None:
+        """Copia o modelo Excel do projeto, criando abas Variacao (e tabelas) para os municípios que não existem nele."""
+        source = PROJECT_ROOT / config['DEFAULT']['OutputDirectory'] / config['DEFAULT']['OutputFileName']
+        if not source.exists():
+            logging.warning(f"Modelo Excel não encontrado em {source}: etapas do Excel não serão medidas.")
+            return
+        target = self.root / config['DEFAULT']['OutputDirectory'] / config['DEFAULT']['OutputFileName']
+        workbook = openpyxl.load_workbook(source)
+        model_sheet = next(workbook[name] for name in workbook.sheetnames if name.startswith('Variacao'))
+        model_sig = model_sheet.title[len('Variacao'):]
+        for sig_mun in sig_muns:
+            if f"Variacao{sig_mun}" in workbook.sheetnames:
+                continue
+            sheet = workbook.copy_worksheet(model_sheet)
+            sheet.title = f"Variacao{sig_mun}"
+            for table in model_sheet.tables.values():
+                copied = deepcopy(table)
+                copied.name = copied.displayName = table.displayName.replace(model_sig, sig_mun)
+                sheet.add_table(copied)
+                # Fórmulas da linha de totais fazem referência estruturada ao nome da tabela
+                for row in sheet.iter_rows():
+                    for cell in row:
+                        if isinstance(cell.value, str) and f"{table.displayName}[" in cell.value:
+                            cell.value = cell.value.replace(f"{table.displayName}[", f"{copied.displayName}[")
+        workbook.save(target)
+        workbook.close()
+
+def measure_pipeline(root: str, input_rows: int, excel: bool = True) -> Dict:
+    """Executa as etapas do processamento sobre o projeto em root, medindo tempo, vazão e pico de memória de cada uma."""
+    # Executada em um processo novo por cenário: o pico de memória (ru_maxrss) não é contaminado por cenários anteriores
+    os.chdir(root)
+    logging.basicConfig(filename='benchmark.log', level=logging.INFO)
+    from src.Controller import Controller
+
+    project_root = Path(root)
+    controller = Controller(project_root, headless=True)
+    model, config = controller.model, controller.config
+    output_file = project_root / config['DEFAULT']['OutputDirectory'] / config['DEFAULT']['OutputFileName']
+    stages: Dict[str, Dict] = {}
+
+    def timed(stage: str, action, records=None):
+        with span(stage) as record:
+            result = action()
+        # records: número de registros da etapa, ou função que o obtém do resultado
+        records = records(result) if callable(records) else records
+        stages[stage] = {'seconds': round(record.wall, 4), 'records': records,
+                         'records_per_second': round(records / record.wall, 1) if records and record.wall > 0 else None,
+                         'peak_rss_mb': record.peak_memory}
+        logging.info(f"Benchmark: etapa {stage} concluída em {record.wall:.2f} segundos")
+        return result
+
+    timed('ingest', controller.load_all_data, input_rows)
+    timed('dedupe', model.remove_duplicates, input_rows)
+    df_unified, df_evol, anos = timed('tables', model.build_tables, lambda tables: len(tables[0]))
+    df_analysis = timed('variations', lambda: model.calculate_variations(df_evol, anos), len(df_evol))
+
+    excel_rows = max(len(df_unified), len(df_evol)) + controller.view.start_row
+    if not excel:
+        skipped = 'desligada por --no-excel'
+    elif not output_file.exists():
+        skipped = 'modelo Excel ausente'
+    elif excel_rows > EXCEL_MAX_ROWS:
+        skipped = f"{excel_rows} linhas excedem o limite de {EXCEL_MAX_ROWS} linhas por aba do Excel"
+    else:
+        skipped = None
+        # Mesma chamada do Controller: a análise (abas Analise) é gravada por update_excel no mesmo workbook
+        analyzer = controller.integrated_analyzer()
+        timed('excel_view', lambda: controller.view.update_excel(str(output_file), df_unified, df_evol, df_analysis, analyzer),
+              len(df_unified) + len(df_evol) * 2)
+        if analyzer is None:
+            stages['data_analyzer'] = {'skipped': 'desligada por [PERFORMANCE] IntegratedAnalysis'}
+        else:
+            # Parcela de excel_view gasta na análise, somada dos spans registrados pela View
+            analysis = [record for record in metrics.spans if record.name == 'analysis']
+            seconds = sum(record.wall for record in analysis)
+            stages['data_analyzer'] = {'seconds': round(seconds, 4), 'records': len(df_evol),
+                                       'records_per_second': round(len(df_evol) / seconds, 1) if seconds > 0 else None,
+                                       'peak_rss_mb': max((record.peak_memory or 0 for record in analysis), default=None)}
+    for stage in STAGES:
+        if stage not in stages:
+            stages[stage] = {'skipped': skipped}
+
+    return {'input_rows': input_rows, 'unified_rows': len(df_unified), 'taxpayers': len(df_evol),
+            'stages': stages, 'peak_rss_mb': peak_memory_mb()}
+
+def run_scenario(municipalities: int, taxpayers: int, windows: int, seed: int, overrides: Dict[Tuple[str, str], str],
+                 workdir: Optional[Path], keep: bool, excel: bool = True) -> Dict:
+    """Gera a base sintética de um cenário e mede o processamento em um processo separado."""
+    root = Path(tempfile.mkdtemp(prefix=f"bench_{municipalities}x{taxpayers}_", dir=workdir))
+    try:
+        dataset = SyntheticDataset(root, municipalities, taxpayers, windows=windows, seed=seed)
+        start_time = time.perf_counter()
+        dataset.generate(overrides, template=excel)
+        generation = time.perf_counter() - start_time
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            result = pool.submit(measure_pipeline, str(root), dataset.input_rows, excel).result()
+        result.update({'municipalities': municipalities, 'taxpayers_requested': taxpayers, 'windows': windows,
+                       'input_mb': round(dataset.input_bytes / 2**20, 2), 'generation_seconds': round(generation, 2)})
+        result['stages']['ingest']['mb_per_second'] = (
+            round(result['input_mb'] / result['stages']['ingest']['seconds'], 2) if result['stages']['ingest']['seconds'] else None)
+        return result
+    finally:
+        if keep:
+            logging.info(f"Base sintética mantida em {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+def git_revision() -> Optional[str]:
+    """Revisão do repositório em que o benchmark foi executado (None fora de um repositório git)."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_scale(text: str) -> Tuple[int, int]:
+    """Converte 'MUNICIPIOSxCONTRIBUINTES' (ex.: 3x1000, 92x1000000) em uma tupla de inteiros."""
+    municipalities, _, taxpayers = text.lower().partition('x')
+    try:
+        scale = int(municipalities), int(taxpayers.replace('_', ''))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Escala inválida: {text} (use MUNICIPIOSxCONTRIBUINTES, ex.: 3x1000)")
+    if scale[0] < 1 or scale[1] < 1:
+        raise argparse.ArgumentTypeError(f"Escala inválida: {text}")
+    return scale
+
+def parse_override(text: str) -> Tuple[Tuple[str, str], str]:
+    """Converte 'SECAO.Chave=valor' em uma substituição do Config.ini do cenário."""
+    key, sep, value = text.partition('=')
+    section, dot, option = key.partition('.')
+    if not sep or not dot:
+        raise argparse.ArgumentTypeError(f"Substituição inválida: {text} (use SECAO.Chave=valor)")
+    return (section, option), value
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Gera as bases sintéticas, mede cada cenário e grava os resultados em JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark do processamento com bases sintéticas no layout DECLAN.")
+    parser.add_argument('--scale', type=parse_scale, action='append',
+                        help="cenário MUNICIPIOSxCONTRIBUINTES (repetível; padrão: 3x1000)")
+    parser.add_argument('--windows', type=int, default=5, help="número de janelas de 3 anos por município (padrão: 5)")
+    parser.add_argument('--seed', type=int, default=0, help="semente do gerador de dados")
+    parser.add_argument('--set', type=parse_override, action='append', default=[], dest='overrides',
+                        help="substitui uma chave do Config.ini no cenário (ex.: PERFORMANCE.DataEngine=long)")
+    parser.add_argument('--output', type=Path, help="arquivo JSON de resultados (padrão: data/benchmark/benchmark_<data>.json)")
+    parser.add_argument('--workdir', type=Path, help="diretório para as bases sintéticas (padrão: diretório temporário)")
+    parser.add_argument('--keep', action='store_true', help="mantém as bases sintéticas geradas")
+    parser.add_argument('--no-excel', action='store_true', help="mede apenas as etapas em memória (sem ExcelView e DataAnalyzer)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    overrides = dict(args.overrides)
+    started = datetime.now()
+    runs = []
+    for municipalities, taxpayers in args.scale or [(3, 1000)]:
+        logging.info(f"Cenário: {municipalities} municípios, {taxpayers} contribuintes, {args.windows} janelas")
+        result = run_scenario(municipalities, taxpayers, args.windows, args.seed, overrides, args.workdir, args.keep,
+                              excel=not args.no_excel)
+        for stage in STAGES:
+            timing = result['stages'][stage]
+            if 'seconds' in timing:
+                logging.info(f"  {stage:<14} {timing['seconds']:>9.2f} s  pico {timing['peak_rss_mb'] or 0:>8.1f} MB")
+            else:
+                logging.info(f"  {stage:<14} ignorada ({timing['skipped']})")
+        runs.append(result)
+
+    output = args.output or PROJECT_ROOT / 'data' / 'benchmark' / f"benchmark_{started:%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'started': started.isoformat(timespec='seconds'), 'revision': git_revision(),
+                   'python': sys.version.split()[0], 'pandas': pd.__version__, 'numpy': np.__version__,
+                   'platform': platform.platform(), 'cpus': os.cpu_count(),
+                   'overrides': {f"{section}.{key}": value for (section, key), value in overrides.items()},
+                   'runs': runs}, f, indent=2)
+    logging.info(f"Resultados gravados em {output}")
+
+if __name__ == "__main__":
+    main()
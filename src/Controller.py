@@ -1,20 +1,37 @@
 # Controller.py
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from src.Model import DataModel
+from typing import Callable, Dict, List, Optional
+from src.DataAnalyzer import DataAnalyzer
+from src.DataExport import ParquetExporter, parquet_available
+from src.IngestCache import IngestCache, cache_available
+from src.Instrumentation import configure_logging, hot_functions, metrics, profiled, span
+from src.Model import DataModel, ParsedFile, index_input_files, parse_var_anual
 from src.View import ExcelView
 import configparser
+import json
 import logging
+import pandas as pd
 import time
 
 class Controller:
-    def __init__(self, project_root: Path):
-        """Inicialização do Controller com configuração e componentes de modelo e visão."""
+    def __init__(self, project_root: Path, rebuild_cache: bool = False, headless: bool = False, profile: Optional[Path] = None,
+                 sig_mun: Optional[str] = None):
+        """Inicialização do Controller com configuração e componentes de modelo e visão (sig_mun: consulta de um só município)."""
         self.project_root = project_root
+        self.sig_mun = sig_mun
+        self.rebuild_cache = rebuild_cache
+        self.headless = headless
+        self.profile = profile
         self.config = self.load_config()
-        self.model = DataModel(self.project_root, self.config)
+        # Um único arquivo de log para toda a execução, configurado antes de qualquer componente registrar mensagens
+        configure_logging(self.project_root / self.config.get('DEFAULT', 'LogFile', fallback='logs/tabula.log'))
+        self.model = DataModel(self.project_root, self.config, sig_mun)
+        if sig_mun is not None and sig_mun not in self.model.sig_mun_map:
+            raise ValueError(f"SigMun desconhecido: {sig_mun} (municípios em resources/TAB_ApoioSigMun.json: {', '.join(self.model.sig_mun_map)})")
         self.view = ExcelView(self.config, self.project_root)
-        logging.basicConfig(filename='controller.log', level=logging.INFO)
 
     def load_config(self) -> configparser.ConfigParser:
         """Carrega configurações do arquivo Config.ini."""
@@ -25,35 +42,173 @@ class Controller:
     def run(self) -> None:
         """Executa o processo completo de carregamento, processamento e salvamento dos dados."""
         start_time = time.time()
+        metrics.reset()
+        profiler = None
         try:
-            self.load_all_data()
-            self.process_and_save_data()
+            with profiled(self.profile) as profiler, span('run'):
+                self.load_all_data()
+                self.process_and_save_data()
             end_time = time.time()
             logging.info(f"Processo completo executado em {end_time - start_time:.2f} segundos")
         except Exception as e:
             logging.error(f"Erro durante a execução: {str(e)}")
             raise
+        finally:
+            self.save_run_report(profiler)
+
+    def save_run_report(self, profiler=None) -> None:
+        """Registra no log o tempo das etapas e grava o relatório da execução ([PERFORMANCE] RunReport; vazio = não gravar)."""
+        for record in metrics.spans:
+            if record.depth <= 1:
+                logging.info(f"Etapa {record.path}: {record.wall:.2f} s (CPU {record.cpu:.2f} s), linhas: {record.rows}")
+        report_path = self.config.get('PERFORMANCE', 'RunReport', fallback='')
+        if not report_path:
+            return
+        extra = {'config': {key: value for key, value in self.config['PERFORMANCE'].items()}}
+        if profiler is not None:
+            extra['hot_functions'] = hot_functions(profiler)
+            extra['profile'] = str(self.profile)
+        metrics.save(self.project_root / report_path, **extra)
+
+    def ingest_workers(self) -> int:
+        """Número de processos para a leitura dos CSV ([PERFORMANCE] IngestWorkers; 0 = número de CPUs)."""
+        workers = self.config.getint('PERFORMANCE', 'IngestWorkers', fallback=1)
+        return workers if workers > 0 else (os.cpu_count() or 1)
+
+    def open_ingest_cache(self) -> Optional[IngestCache]:
+        """Abre o cache de leitura dos CSV, se habilitado em [PERFORMANCE] e se houver suporte a Feather (pyarrow)."""
+        if not self.config.getboolean('PERFORMANCE', 'IngestCache', fallback=False):
+            return None
+        if not cache_available():
+            logging.warning("Cache de leitura desabilitado: o pacote pyarrow não está instalado.")
+            return None
+
+        cache_dir = self.project_root / self.config.get('PERFORMANCE', 'IngestCacheDirectory', fallback='data/cache')
+        max_bytes = self.config.getint('PERFORMANCE', 'IngestCacheMaxMB', fallback=512) * 2**20
+        # O SigMun é resolvido durante a leitura: mudanças no TAB_ApoioSigMun.json invalidam o cache
+        salt = json.dumps(self.model.mun_sig_index, sort_keys=True)
+        cache = IngestCache(cache_dir, max_bytes, salt)
+        if self.rebuild_cache:
+            cache.clear()
+        return cache
+
+    def input_files(self) -> List[Path]:
+        """Arquivos CSV a carregar: todos os do diretório de entrada ou, na consulta de um município, apenas os do seu prefixo XXX_."""
+        input_dir = self.project_root / self.config['DEFAULT']['InputDirectory']
+        if self.sig_mun is None:
+            return [input_dir / file for file in sorted(os.listdir(input_dir)) if file.endswith('.csv')]
+        files = index_input_files(input_dir).get(self.sig_mun, [])
+        if not files:
+            raise FileNotFoundError(f"Nenhum arquivo {self.sig_mun}_VarAnual-*.csv em {input_dir}")
+        logging.info(f"Consulta do município {self.sig_mun}: {len(files)} arquivos de entrada")
+        return files
 
     def load_all_data(self) -> None:
-        """Carrega todos os arquivos CSV do diretório de entrada."""
+        """Carrega os arquivos CSV do diretório de entrada (ou só os do município consultado), relendo apenas os que não estão no cache."""
         input_dir = self.project_root / self.config['DEFAULT']['InputDirectory']
-        for file in sorted(os.listdir(input_dir)):
-            if file.endswith('.csv'):
-                self.model.load_data(input_dir / file)
+        files = self.input_files()
+        cache = self.open_ingest_cache()
+
+        with span('ingest', files=len(files)) as ingest:
+            parsed_files: Dict[Path, ParsedFile] = {}
+            if cache is not None:
+                with span('ingest_cache') as cache_span:
+                    for file_path in files:
+                        start_time = time.time()
+                        cached = cache.get(file_path)
+                        if cached is not None:
+                            frame, unresolved, missing_insc_est = cached
+                            parsed_files[file_path] = ParsedFile(file_path.name, frame, unresolved, missing_insc_est,
+                                                                 time.time() - start_time)
+                    cache_span.rows = sum(len(parsed.frame) for parsed in parsed_files.values())
+
+            to_parse = [file_path for file_path in files if file_path not in parsed_files]
+            with span('ingest_parse', files=len(to_parse)) as parse_span:
+                parsed_list = self.parse_files(to_parse)
+                parse_span.rows = sum(len(parsed.frame) for parsed in parsed_list)
+            for parsed in parsed_list:
+                parsed_files[input_dir / parsed.file_name] = parsed
+                if cache is not None:
+                    cache.put(input_dir / parsed.file_name, parsed.frame, parsed.unresolved, parsed.missing_insc_est)
+            if cache is not None:
+                cache.save()
+
+            # Mesclagem sempre na ordem dos nomes de arquivo, independentemente da origem (cache, leitura serial ou paralela)
+            with span('ingest_merge'):
+                self.model.begin_batch()
+                for file_path in files:
+                    self.model.add_parsed(parsed_files[file_path])
+                self.model.end_batch()
+            ingest.rows = sum(len(parsed.frame) for parsed in parsed_files.values())
+
+    def parse_files(self, files: List[Path]) -> List[ParsedFile]:
+        """Lê e transforma os arquivos CSV informados, em paralelo quando configurado."""
+        workers = min(self.ingest_workers(), len(files))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(parse_var_anual, files, repeat(self.model.mun_sig_index)))
+        return [parse_var_anual(file_path, self.model.mun_sig_index) for file_path in files]
+
+    def integrated_analyzer(self) -> Optional[Callable]:
+        """Retorna a etapa de análise (abas Analise) a executar no mesmo workbook da View, se [PERFORMANCE] IntegratedAnalysis."""
+        if not self.config.getboolean('PERFORMANCE', 'IntegratedAnalysis', fallback=False):
+            return None
+        # A View entrega à análise o df_evol em memória (inteiro ou do shard), sem reler a aba TAB_EvolRazSoc do arquivo salvo
+        return DataAnalyzer(str(self.project_root), self.config).analyzeFrame
+
+    def excel_output(self) -> bool:
+        """Indica se o arquivo Excel deve ser gravado (desligado por --headless ou [PERFORMANCE] ExcelOutput = False)."""
+        return not self.headless and self.config.getboolean('PERFORMANCE', 'ExcelOutput', fallback=True)
+
+    def export_data(self, df_unified: pd.DataFrame, df_evol: pd.DataFrame, df_analysis: Dict[str, pd.DataFrame]) -> None:
+        """Exporta as tabelas processadas em Parquet particionado, se habilitado em [PERFORMANCE] ParquetExport."""
+        if not self.config.getboolean('PERFORMANCE', 'ParquetExport', fallback=False):
+            return
+        if not parquet_available():
+            logging.warning("Exportação Parquet desabilitada: o pacote pyarrow não está instalado.")
+            return
+        with span('parquet', rows=len(df_unified)):
+            ParquetExporter(self.config, self.project_root).export(df_unified, df_evol, df_analysis)
+
+    def save_municipality(self, df_evol: pd.DataFrame, df_analysis: Dict[str, pd.DataFrame]) -> None:
+        """Recalcula as abas Variacao e Analise do município consultado no arquivo Excel existente."""
+        if self.sig_mun not in df_analysis:
+            raise ValueError(f"Nenhum contribuinte do município {self.sig_mun} nos arquivos de entrada.")
+        if not self.excel_output():
+            logging.info("Execução sem Excel: arquivo Excel não atualizado.")
+            return
+        output_file = self.project_root / self.config['DEFAULT']['OutputDirectory'] / self.config['DEFAULT']['OutputFileName']
+        # A aba Analise do município é sempre recalculada, com o df_evol em memória (restrito ao município)
+        analyzer = DataAnalyzer(str(self.project_root), self.config)
+        with span('excel', rows=len(df_analysis[self.sig_mun]), engine='openpyxl', mode='municipality', sig_mun=self.sig_mun):
+            self.view.update_municipality(str(output_file), self.sig_mun, df_analysis[self.sig_mun], df_evol,
+                                          analyzer.analyzeFrame, analyzer.sheetFingerprints(df_evol))
+        logging.info(f"Consulta do município {self.sig_mun}: {len(df_evol)} contribuintes")
 
     def process_and_save_data(self) -> None:
-        """Processa os dados e atualiza o arquivo Excel."""
+        """Processa os dados, exporta as tabelas e atualiza o arquivo Excel."""
         try:
-            self.model.remove_duplicates()
+            with span('dedupe'):
+                self.model.remove_duplicates()
             df_unified, df_evol, df_analysis = self.model.process_data()
+            if self.sig_mun is not None:
+                # Consulta de um município: sem exportação Parquet, que substituiria os conjuntos de todo o estado
+                self.save_municipality(df_evol, df_analysis)
+                return
+            self.export_data(df_unified, df_evol, df_analysis)
             output_file = self.project_root / self.config['DEFAULT']['OutputDirectory'] / self.config['DEFAULT']['OutputFileName']
-            self.view.update_excel(str(output_file), df_unified, df_evol, df_analysis)
+            if self.excel_output():
+                with span('excel', rows=len(df_unified) + 2 * len(df_evol), engine=self.view.engine, mode=self.view.output_mode):
+                    self.view.update_excel(str(output_file), df_unified, df_evol, df_analysis, self.integrated_analyzer())
+            else:
+                logging.info("Execução sem Excel: arquivo Excel não atualizado.")
             
             logging.info(f"\nResumo:")
             logging.info(f"Total de registros processados: {len(df_unified)}")
             logging.info(f"Número de municípios: {df_unified['MUNICIPIO'].nunique()}")
-            logging.info(f"Anos cobertos: {', '.join(sorted(df_unified['ANO'].unique()))}")
-            logging.info(f"Arquivo Excel atualizado: {output_file}")
+            logging.info(f"Anos cobertos: {', '.join(str(ano) for ano in sorted(df_unified['ANO'].unique()))}")
+            if self.excel_output():
+                logging.info(f"Arquivo Excel atualizado: {output_file}")
         except Exception as e:
             logging.error(f"Erro ao processar e salvar dados: {str(e)}")
-            raise
\ No newline at end of file
+            raise
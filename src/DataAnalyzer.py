@@ -1,15 +1,25 @@
 ### DataAnalyzer.py
 import os
+import re
+import tempfile
 import json
 import logging
+from copy import copy
 from datetime import datetime
+from pathlib import Path
 import configparser
 import pandas as pd
 import numpy as np
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, Alignment, NamedStyle
 from openpyxl.worksheet.page import PageMargins
-from typing import Dict, Tuple
+from typing import Dict, List, Optional, Tuple
+from src.Instrumentation import configure_logging, span
+from src.ParallelRender import merge_sheet, render_in_workers, render_workers
+from src.Fingerprints import SHARD_MANIFEST, SheetFingerprints, frame_fingerprint, load_shard_manifest
+
+# Trends of the variation ranking, in the order of the trend codes and of the sheet blocks
+TREND_NAMES = ['CRESCIMENTO', 'ESTÁVEL', 'DECLÍNIO']
 
 class DataAnalyzer:
     def __init__(self, projectRoot: str, config: configparser.ConfigParser):
@@ -21,21 +31,18 @@ class DataAnalyzer:
         """
         self.projectRoot = projectRoot
         self.config = config
-        self.sigMunMap = {"Areal": "ARE", "Itaguai": "ITG", "Porto Real": "POR"}
         self.formatKeywords = self.loadFormatKeywords()
+        self.keywordPatterns = self.compileKeywordPatterns()
+        self.styleDecisions = {}
+        self.styleRegistry = self.buildStyleRegistry()
+        self.styleWorkbook = None
+        self.stylePrototypes = {}
         self.setupLogging()
 
     def setupLogging(self):
         """Configure the logging system to record debug and information messages."""
-        logPath = os.path.join(self.projectRoot, "logs", "data_analyzer.log")
-        os.makedirs(os.path.dirname(logPath), exist_ok=True)
-
-        logging.basicConfig(
-            filename=logPath,
-            level=logging.INFO,  # INFO, DEBUG, WARNING
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
+        # When run from the Controller, the run's log file is already configured and is kept
+        configure_logging(Path(self.projectRoot) / "logs" / "data_analyzer.log")
 
     def loadFormatKeywords(self):
         """
@@ -47,6 +54,19 @@ class DataAnalyzer:
         with open(jsonPath, 'r', encoding='utf-8') as file:
             return json.load(file)
 
+    def compileKeywordPatterns(self) -> Dict[str, re.Pattern]:
+        """
+        Compile the formatting keywords, normalized once, into a single regex per style.
+        Monetary keywords come first, so they take precedence over percentage keywords.
+
+        :return: Dictionary mapping the named style to its compiled keyword pattern
+        """
+        patterns = {}
+        for styleName, keywordsKey in (('accounting_style', 'monetary_keywords'), ('percent_style', 'percentage_keywords')):
+            keywords = sorted({self.normalizeString(keyword) for keyword in self.formatKeywords[keywordsKey]}, key=len, reverse=True)
+            patterns[styleName] = re.compile('|'.join(re.escape(keyword) for keyword in keywords))
+        return patterns
+
     def analyzeData(self, excelFile: str) -> None:
         """
         Analyze data from an Excel file.
@@ -56,55 +76,169 @@ class DataAnalyzer:
         logging.info(f"Starting analysis of file: {excelFile}")
         workbook = load_workbook(excelFile)
         df = pd.read_excel(excelFile, sheet_name='TAB_EvolRazSoc', header=5)
+        self.analyzeFrame(df, workbook)
+        workbook.save(excelFile)
+        logging.info("Analysis completed and file saved.")
+
+    def analyzeShards(self, outputDirectory: str) -> None:
+        """
+        Analyze each per-municipality workbook (Tabula_<SigMun>.xlsx) listed in the shard manifest.
+
+        :param outputDirectory: Directory containing the shards and their manifest
+        """
+        manifestPath = os.path.join(outputDirectory, SHARD_MANIFEST)
+        if not os.path.exists(manifestPath):
+            logging.warning(f"Shard manifest not found: {manifestPath}")
+            return
+        sigMuns = sorted(load_shard_manifest(manifestPath))
+        for sigMun in sigMuns:
+            excelFile = os.path.join(outputDirectory, f"Tabula_{sigMun}.xlsx")
+            if os.path.exists(excelFile):
+                self.analyzeData(excelFile)
+            else:
+                logging.warning(f"Shard not found: {excelFile}")
+
+    def analyzeFrame(self, df: pd.DataFrame, workbook, fingerprints: Optional[SheetFingerprints] = None) -> None:
+        """
+        Analyze the evolution table and write one Analise sheet per municipality into an open workbook.
+        Used directly by the Controller with the in-memory evolution table, so the saved file is not read back.
+
+        :param df: DataFrame with the layout of the TAB_EvolRazSoc sheet (identification columns and one column per year)
+        :param workbook: Excel workbook object where the sheets will be written (saving it is up to the caller)
+        :param fingerprints: Fingerprints of the sheets written by previous runs; when given, unchanged sheets are kept as they are
+        """
+        if fingerprints is not None:
+            df = self.selectChangedMunicipalities(df, workbook, fingerprints)
+            if df.empty:
+                logging.info("All analysis sheets are up to date")
+                return
+
+        with span('analysis_statistics', rows=len(df)):
+            statistics = self.computeStatistics(self.prepareFrame(df))
+        logging.info(f"Municipalities to be analyzed: {list(statistics)}")
+        
+        workers = render_workers(self.config)
+        if workers > 1 and len(statistics) > 1:
+            self.renderParallel(statistics, workbook, workers)
+            return
+
+        for stats in statistics.values():
+            with span('analysis_municipio', sig_mun=stats['sigMun']):
+                self.analyzeMunicipio(stats, workbook)
+
+    def selectChangedMunicipalities(self, df: pd.DataFrame, workbook, fingerprints: SheetFingerprints) -> pd.DataFrame:
+        """
+        Keep only the municipalities whose Analise sheet is missing or was written from other data or settings.
+        The fingerprint covers the municipality's rows of the evolution table, the ANALYSIS and FORMATTING
+        settings and the style keywords; sheets left out keep any manual changes, such as print settings.
+
+        :param df: DataFrame with the layout of the TAB_EvolRazSoc sheet
+        :param workbook: Excel workbook object where the sheets are written
+        :param fingerprints: Fingerprints of the sheets written by previous runs
+        :return: Rows of the municipalities whose sheet must be rewritten, in their original order
+        """
+        salt = self.fingerprintSalt()
+        changedRows = []
+        for sigMun, rows in df.groupby('SigMun', sort=False, observed=True).indices.items():
+            if fingerprints.changed(f"Analise{sigMun}", frame_fingerprint(df.iloc[rows], salt=salt), workbook.sheetnames):
+                changedRows.append(rows)
+            else:
+                logging.info(f"Sheet Analise{sigMun} is up to date, kept.")
+        return df.iloc[np.sort(np.concatenate(changedRows))] if changedRows else df.iloc[:0]
+
+    def sheetFingerprints(self, df: pd.DataFrame) -> Dict[str, str]:
+        """
+        Compute the fingerprint of each municipality's Analise sheet without touching any workbook,
+        so callers can tell beforehand whether analyzeFrame would rewrite anything.
+
+        :param df: DataFrame with the layout of the TAB_EvolRazSoc sheet
+        :return: Fingerprints keyed by sheet name (Analise<SigMun>)
+        """
+        salt = self.fingerprintSalt()
+        return {f"Analise{sigMun}": frame_fingerprint(df.iloc[rows], salt=salt)
+                for sigMun, rows in df.groupby('SigMun', sort=False, observed=True).indices.items()}
+
+    def fingerprintSalt(self) -> str:
+        """
+        Settings that shape the Analise sheets, mixed into their fingerprints.
+
+        :return: JSON text of the ANALYSIS and FORMATTING sections and the style keywords
+        """
+        return json.dumps({'ANALYSIS': dict(self.config['ANALYSIS']), 'FORMATTING': dict(self.config['FORMATTING']),
+                           'keywords': self.formatKeywords}, sort_keys=True)
+
+    def renderParallel(self, statistics: Dict[str, Dict], workbook, workers: int) -> None:
+        """
+        Render the Analise sheets in worker processes, one standalone workbook per municipality,
+        and merge them into the workbook in municipality order.
+
+        :param statistics: Statistics of every municipality, as returned by computeStatistics
+        :param workbook: Excel workbook object where the sheets will be merged
+        :param workers: Number of worker processes
+        """
+        logging.info(f"Rendering {len(statistics)} analysis sheets with {workers} worker processes")
+        self.setupStyles(workbook)
+        tasks = [(self.projectRoot, self.config, stats) for stats in statistics.values()]
+        with tempfile.TemporaryDirectory(prefix='analise_') as outputDir:
+            paths = render_in_workers(renderAnaliseWorkbook, tasks, workers, outputDir)
+            for stats, path in zip(statistics.values(), paths):
+                sheetName = f"Analise{stats['sigMun']}"
+                sheetIndex = None
+                if sheetName in workbook.sheetnames:
+                    sheetIndex = workbook.sheetnames.index(sheetName)
+                    del workbook[sheetName]
+                    logging.info(f"Existing sheet {sheetName} deleted.")
+                sheet = workbook.create_sheet(sheetName, sheetIndex)
+
+                rendered = load_workbook(path)
+                merge_sheet(rendered[sheetName], sheet)
+                rendered.close()
+                self.adjustColumnWidths(sheet)
+                logging.info(f"Sheet {sheetName} merged.")
+
+    def prepareFrame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drop empty and total rows and normalize the types of the evolution table.
+
+        :param df: DataFrame with the layout of the TAB_EvolRazSoc sheet
+        :return: Cleaned copy of the DataFrame
+        """
         df = df.dropna(how='all').reset_index(drop=True)
         df = df.dropna(subset=['MUNICIPIO']).reset_index(drop=True)
         df = df.fillna(0)
         df['InscEst'] = df['InscEst'].astype(str)
-        
-        municipios = df['MUNICIPIO'].unique()
-        logging.info(f"Municipalities to be analyzed: {municipios}")
-        
-        for municipio in municipios:
-            dfMun = df[df['MUNICIPIO'] == municipio].copy()
-            self.analyzeMunicipio(dfMun, workbook, excelFile)
-        
-        workbook.save(excelFile)
-        logging.info("Analysis completed and file saved.")
+        df.columns = [str(col) for col in df.columns]
+        return df
 
-    def analyzeMunicipio(self, dfMun: pd.DataFrame, workbook, excelFile: str) -> None:
+    def analyzeMunicipio(self, stats: Dict, workbook) -> None:
         """
-        Analyze data for a specific municipality.
+        Write the Analise sheet of a municipality from its precomputed statistics.
 
-        :param dfMun: DataFrame containing data for the municipality
+        :param stats: Statistics of the municipality, as returned by computeStatistics
         :param workbook: Excel workbook object
-        :param excelFile: Path to the Excel file to be analyzed
         """
-        municipio = dfMun['MUNICIPIO'].iloc[0]
-        sigMun = self.sigMunMap.get(municipio, "")
+        municipio = stats['municipio']
+        sigMun = stats['sigMun']
         sheetName = f"Analise{sigMun}"
         logging.info(f"Analyzing municipality: {municipio} (Abbreviation: {sigMun})")
         
+        # A recreated sheet keeps its position, so updating a single municipality does not reorder the workbook
+        sheetIndex = None
         if sheetName in workbook.sheetnames:
+            sheetIndex = workbook.sheetnames.index(sheetName)
             del workbook[sheetName]
             logging.info(f"Existing sheet {sheetName} deleted.")
         
-        workbook.create_sheet(sheetName)
+        workbook.create_sheet(sheetName, sheetIndex)
         sheet = workbook[sheetName]
         logging.info(f"New sheet {sheetName} created.")
 
         # Insert titles in the sheet
         self.insertTitles(sheet, municipio)        
         
-        totalByYear = self.calculateTotalByYear(dfMun)
-        totalContributors = len(dfMun)
-        trendCounts, topTrendsLast, topTrendsFull = self.analyzeTrends(dfMun)
-        standardDeviation = self.calculateStandardDeviation(dfMun)
-        topContributors = self.getTopContributors(dfMun)
-        zeroMovement = self.identifyZeroMovement(dfMun)
-        
-        self.updateExcel(sheet, totalByYear, totalContributors,
-                          trendCounts, standardDeviation, topTrendsLast, topTrendsFull, 
-                          topContributors, zeroMovement)
+        self.updateExcel(sheet, stats['totalByYear'], stats['totalContributors'],
+                          stats['trendCounts'], stats['standardDeviation'], stats['topTrendsLast'], stats['topTrendsFull'], 
+                          stats['movingAverage'], stats['linearTrend'], stats['topContributors'], stats['zeroMovement'])
         
     def insertTitles(self, sheet, municipio: str):
         """
@@ -133,51 +267,97 @@ class DataAnalyzer:
         cellTitle3.font = self.getFontConfiguration('title3')
         logging.debug(f"Title inserted at line {startTitle3}: Relatório Calculado em: {currentDate}")
 
-    def calculateTotalByYear(self, df: pd.DataFrame) -> pd.Series:
+    def computeStatistics(self, df: pd.DataFrame) -> Dict[str, Dict]:
         """
-        Calculate the total value aggregated by year.
+        Compute the statistics of every municipality in one batch. Row-wise measures (variations, standard
+        deviation, mean, median, moving averages, least-squares trend, zero movement) are computed once over
+        the year matrix of all taxpayers and yearly totals with a single groupby; each municipality then only
+        filters and ranks its own rows.
 
-        :param df: DataFrame containing data to be analyzed
-        :return: Series containing total values by year
+        :param df: Prepared evolution table (see prepareFrame)
+        :return: Dictionary keyed by municipality, in order of appearance, with the data of each Analise section
         """
-        return df.filter(regex='^20(1[7-9]|2[0-3])').sum()
-
-    def analyzeTrends(self, df: pd.DataFrame) -> Tuple[Dict[str, int], Dict[str, pd.DataFrame], Dict[str, pd.DataFrame]]:
-        """
-        Analyze trends in the data.
-
-        :param df: DataFrame containing data to be analyzed
-        :return: Tuple containing trend counts and top trends
-        """
-        allYears = sorted([col for col in df.columns if col.startswith('20')])
+        logging.info("Calculating statistics for all municipalities")
         initialYear = self.config['ANALYSIS']['InitialYear']
-        lastYear = allYears[-1]
-        penultimateYear = allYears[-2]
-        
+        yearColumns = [col for col in df.columns if col.startswith('20')]
+        allYears = sorted(yearColumns)
+        analysisYears = [year for year in allYears if year >= initialYear]
+        lastYear, penultimateYear = allYears[-1], allYears[-2]
+
+        yearMatrix = df[analysisYears].to_numpy(dtype=float)
+        movingWindow = self.config.getint('ANALYSIS', 'MovingAverageWindow', fallback=3)
+        movingAverages = self.calculateMovingAverages(yearMatrix, movingWindow)
+        slope, rSquared = self.calculateLinearTrend(yearMatrix, [int(year) for year in analysisYears])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variationPctFull = self.calculateVariation(df, initialYear, lastYear)
+            variationPctLast = self.calculateVariation(df, penultimateYear, lastYear)
+            variationMoving = np.where(movingAverages[:, 0] != 0,
+                                       (movingAverages[:, -1] - movingAverages[:, 0]) / movingAverages[:, 0],
+                                       np.where(movingAverages[:, -1] != 0, 1, 0))
+        frame = df.assign(**{
+            'variationPctFull': variationPctFull,
+            'variationPctLast': variationPctLast,
+            'variationAbsFull': df[lastYear] - df[initialYear],
+            'variationAbsLast': df[lastYear] - df[penultimateYear],
+            'VALOR DP': yearMatrix.std(axis=1, ddof=1),
+            'MÉDIA': yearMatrix.mean(axis=1),
+            'MEDIANA': np.median(yearMatrix, axis=1),
+            'movingFirst': movingAverages[:, 0],
+            'movingLast': movingAverages[:, -1],
+            'variationMoving': variationMoving,
+            'trendSlope': slope,
+            'trendRSquared': rSquared
+        })
+        movingFirstYear = analysisYears[max(1, min(movingWindow, len(analysisYears))) - 1]
+        positiveInAllYears = yearMatrix.min(axis=1) > 0
+        withoutMovement = yearMatrix.sum(axis=1) == 0
+
+        grouped = frame.groupby('MUNICIPIO', sort=False, observed=True)
+        totals = grouped[analysisYears].sum()
+        groupRows = grouped.indices
+
         minThreshold = float(self.config['ANALYSIS']['MinimumAnalysisThresholdPercentage']) / 100
-        totalLastYear = df[lastYear].sum()
-        minValue = totalLastYear * minThreshold
-        
-        dfFiltered = df[df[lastYear] >= minValue].copy()
-        
-        dfFiltered.loc[:, 'variationPctFull'] = self.calculateVariation(dfFiltered, initialYear, lastYear)
-        dfFiltered.loc[:, 'variationPctLast'] = self.calculateVariation(dfFiltered, penultimateYear, lastYear)
-        dfFiltered.loc[:, 'variationAbsFull'] = dfFiltered[lastYear] - dfFiltered[initialYear]
-        dfFiltered.loc[:, 'variationAbsLast'] = dfFiltered[lastYear] - dfFiltered[penultimateYear]
-        
         growthLimit = float(self.config['ANALYSIS']['SignificantPositiveVariation']) / 100
-        declineLimit = float(self.config['ANALYSIS']['SignificantNegativeVariation']) / 100
-        
-        trendCounts = {
-            'CRESCIMENTO': sum(dfFiltered['variationPctLast'] > growthLimit),
-            'ESTÁVEL': sum((dfFiltered['variationPctLast'] >= 0) & (dfFiltered['variationPctLast'] <= 0.005)),
-            'DECLÍNIO': sum(dfFiltered['variationPctLast'] < 0)
-        }
-        
-        topTrendsLast = self.prepareTopTrends(dfFiltered, penultimateYear, lastYear, 'variationPctLast', 'variationAbsLast')
-        topTrendsFull = self.prepareTopTrends(dfFiltered, initialYear, lastYear, 'variationPctFull', 'variationAbsFull')
-        
-        return trendCounts, topTrendsLast, topTrendsFull
+        stableBand = float(self.config['ANALYSIS']['StableVariationBand']) / 100
+        deviationCount = int(self.config['ANALYSIS']['StandardDeviation'])
+        contributorsCount = int(self.config['ANALYSIS']['TopContributors'])
+        movingCount = self.config.getint('ANALYSIS', 'MovingAverage')
+        linearCount = self.config.getint('ANALYSIS', 'LinearTrendAnalysis')
+        movingColumns = {'RazSoc': 'NOME / RAZÃO SOCIAL', 'InscEst': 'InscEst', 'movingFirst': f'Média Móvel {movingFirstYear}',
+                         'movingLast': f'Média Móvel {lastYear}', 'variationMoving': 'Variação %'}
+        linearColumns = {'RazSoc': 'NOME / RAZÃO SOCIAL', 'InscEst': 'InscEst', initialYear: f'Valor {initialYear}',
+                         lastYear: f'Valor {lastYear}', 'trendSlope': 'Inclinação R$/ano', 'trendRSquared': 'Ajuste R² %'}
+
+        statistics = {}
+        for municipio in df['MUNICIPIO'].unique():
+            rows = groupRows[municipio]
+            group = frame.iloc[rows]
+            totalByYear = totals.loc[municipio].rename(None)
+
+            dfFiltered = group[group[lastYear] >= totalByYear[lastYear] * minThreshold]
+            _, counts = self.classifyTrends(dfFiltered['variationPctLast'].to_numpy(dtype=float), growthLimit, stableBand)
+            trendCounts = dict(zip(TREND_NAMES, counts.tolist()))
+
+            topContributors = group.nlargest(contributorsCount, yearColumns[-1])[['RazSoc', 'InscEst', yearColumns[-1]]].reset_index(drop=True)
+            topContributors.columns = ['NOME / RAZÃO SOCIAL', 'InscEst', 'Contribuição']
+            zeroMovement = group[withoutMovement[rows]][['RazSoc', 'InscEst']].reset_index(drop=True)
+            zeroMovement.columns = ['NOME / RAZÃO SOCIAL', 'InscEst']
+
+            statistics[municipio] = {
+                'municipio': municipio,
+                'sigMun': group['SigMun'].iloc[0],
+                'totalByYear': totalByYear,
+                'totalContributors': len(group),
+                'trendCounts': trendCounts,
+                'standardDeviation': group[positiveInAllYears[rows]].nlargest(deviationCount, 'VALOR DP')[['RazSoc', 'InscEst', 'VALOR DP', 'MÉDIA', 'MEDIANA']],
+                'topTrendsLast': self.prepareTopTrends(dfFiltered, penultimateYear, lastYear, 'variationPctLast', 'variationAbsLast'),
+                'topTrendsFull': self.prepareTopTrends(dfFiltered, initialYear, lastYear, 'variationPctFull', 'variationAbsFull'),
+                'movingAverage': self.prepareRankedBlocks(dfFiltered, 'variationMoving', movingColumns, movingCount),
+                'linearTrend': self.prepareRankedBlocks(dfFiltered, 'trendSlope', linearColumns, linearCount),
+                'topContributors': topContributors,
+                'zeroMovement': zeroMovement
+            }
+        return statistics
 
     def calculateVariation(self, df: pd.DataFrame, startYear: str, endYear: str) -> pd.Series:
         """
@@ -192,73 +372,140 @@ class DataAnalyzer:
                         (df[endYear] - df[startYear]) / df[startYear],
                         np.where(df[endYear] != 0, 1, 0))
 
-    def prepareTopTrends(self, df: pd.DataFrame, startYear: str, endYear: str, varPctCol: str, varAbsCol: str) -> Dict[str, pd.DataFrame]:
+    def calculateMovingAverages(self, yearMatrix: np.ndarray, window: int) -> np.ndarray:
         """
-        Prepare top trends for growth, stability, and decline.
+        Calculate the moving averages of every taxpayer at once, from cumulative sums over the year columns.
 
-        :param df: DataFrame containing data to be analyzed
-        :param startYear: Starting year for the calculation
-        :param endYear: Ending year for the calculation
-        :param varPctCol: Column name for percentage variation
-        :param varAbsCol: Column name for absolute variation
-        :return: Dictionary containing DataFrames for each trend
+        :param yearMatrix: Matrix of taxpayers (rows) by years (columns)
+        :param window: Number of years in each average (limited to the number of years available)
+        :return: Matrix with one column per complete window, labeled by the last year of the window
         """
-        topTrends = {}
-        for trend, condition in [('CRESCIMENTO', df[varPctCol] > 0.005),
-                                 ('ESTÁVEL', (df[varPctCol] >= 0) & (df[varPctCol] <= 0.005)),
-                                 ('DECLÍNIO', df[varPctCol] < 0)]:
-            topDf = df[condition].nlargest(15, varPctCol)
-            topTrends[trend] = topDf[['RazSoc', 'InscEst', startYear, endYear, varPctCol, varAbsCol]]
-            topTrends[trend].columns = ['NOME / RAZÃO SOCIAL', 'InscEst', f'Valor {startYear}', f'Valor {endYear}', 'Variação %', 'Variação R$']
-            topTrends[trend] = topTrends[trend].sort_values('Variação %', ascending=False)
-        return topTrends
+        window = max(1, min(window, yearMatrix.shape[1]))
+        cumulative = np.zeros((yearMatrix.shape[0], yearMatrix.shape[1] + 1))
+        np.cumsum(yearMatrix, axis=1, out=cumulative[:, 1:])
+        return (cumulative[:, window:] - cumulative[:, :-window]) / window
 
-    def calculateStandardDeviation(self, df: pd.DataFrame) -> pd.DataFrame:
+    def calculateLinearTrend(self, yearMatrix: np.ndarray, years: List[int]):
         """
-        Calculate the standard deviation for each entry across the selected years.
+        Fit a least-squares line to the yearly values of every taxpayer at once (closed form, no per-row fitting).
 
-        :param df: DataFrame containing data to be analyzed
-        :return: DataFrame with standard deviation, mean, and median
+        :param yearMatrix: Matrix of taxpayers (rows) by years (columns)
+        :param years: Years of the matrix columns
+        :return: Tuple with the slope (value per year) and the coefficient of determination R² of each taxpayer
         """
-        logging.info("Calculating standard deviation")
-        initialYear = self.config['ANALYSIS']['InitialYear']
-        allYears = [col for col in df.columns if col.startswith('20') and col >= initialYear]
-        
-        dfFiltered = df[df[allYears].min(axis=1) > 0].copy()
-        
-        dfFiltered['VALOR DP'] = dfFiltered[allYears].std(axis=1)
-        dfFiltered['MÉDIA'] = dfFiltered[allYears].mean(axis=1)
-        dfFiltered['MEDIANA'] = dfFiltered[allYears].median(axis=1)
-        
-        topCount = int(self.config['ANALYSIS']['StandardDeviation'])
-        result = dfFiltered.nlargest(topCount, 'VALOR DP')[['RazSoc', 'InscEst', 'VALOR DP', 'MÉDIA', 'MEDIANA']]
-        
-        logging.debug(f"Standard deviation calculation result:\n{result.head()}")
-        return result
+        centeredYears = np.asarray(years, dtype=float) - np.mean(years)
+        yearsSquares = centeredYears @ centeredYears
+        centeredValues = yearMatrix - yearMatrix.mean(axis=1, keepdims=True)
+        covariance = centeredValues @ centeredYears
+        valuesSquares = np.einsum('ij,ij->i', centeredValues, centeredValues)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = covariance / yearsSquares if yearsSquares else np.zeros(len(yearMatrix))
+            # Constant series have no variability to explain: R² is reported as zero
+            rSquared = np.where(valuesSquares > 0, covariance ** 2 / (yearsSquares * valuesSquares), 0.0)
+        return slope, rSquared
 
-    def getTopContributors(self, df: pd.DataFrame) -> pd.DataFrame:
+    def selectTop(self, values: np.ndarray, count: int, largest: bool = True) -> np.ndarray:
         """
-        Get the top contributors for the last year.
+        Select the positions of the top values with a partial sort (O(n) selection, then sorting only the top).
+        Ties are resolved by position, as in DataFrame.nlargest/nsmallest with keep='first'.
 
-        :param df: DataFrame containing data to be analyzed
-        :return: DataFrame with top contributors
+        :param values: Values to be ranked
+        :param count: Number of positions to select
+        :param largest: Whether the largest (True) or the smallest (False) values are selected
+        :return: Positions of the selected values, from the best to the worst ranked
+        """
+        keys = -values if largest else values
+        if count <= 0 or len(keys) == 0:
+            return np.empty(0, dtype=int)
+        if count < len(keys):
+            # Every value tied with the last selected one stays a candidate, so ties are broken by position
+            threshold = keys[np.argpartition(keys, count - 1)[count - 1]]
+            candidates = np.flatnonzero(keys <= threshold)
+        else:
+            candidates = np.arange(len(keys))
+        return candidates[np.lexsort((candidates, keys[candidates]))][:count]
+
+    def prepareRankedBlocks(self, df: pd.DataFrame, rankColumn: str, columns: Dict[str, str], count: int) -> Dict[str, pd.DataFrame]:
         """
-        lastYear = df.filter(regex='^20').columns[-1]
-        topCount = int(self.config['ANALYSIS']['TopContributors'])
-        contributors = df.nlargest(topCount, lastYear)[['RazSoc', 'InscEst', lastYear]].reset_index(drop=True)
-        contributors.columns = ['NOME / RAZÃO SOCIAL', 'InscEst', 'Contribuição']
-        return contributors
+        Prepare the growth and decline blocks of a ranked section: the largest positive and the most negative values.
 
-    def identifyZeroMovement(self, df: pd.DataFrame) -> pd.DataFrame:
+        :param df: DataFrame containing data to be analyzed
+        :param rankColumn: Column used for ranking
+        :param columns: Columns to be shown, mapped to their titles in the sheet
+        :param count: Number of taxpayers in each block
+        :return: Dictionary with the 'CRESCIMENTO' and 'DECLÍNIO' DataFrames
+        """
+        values = df[rankColumn].to_numpy(dtype=float)
+        blocks = {}
+        for trend, mask, largest in (('CRESCIMENTO', values > 0, True), ('DECLÍNIO', values < 0, False)):
+            positions = np.flatnonzero(mask)
+            selected = positions[self.selectTop(values[positions], count, largest)]
+            blocks[trend] = df.iloc[selected][list(columns)].rename(columns=columns).reset_index(drop=True)
+        return blocks
+
+    def classifyTrends(self, values: np.ndarray, growthLimit: float, stableBand: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Classify each variation into CRESCIMENTO (0), ESTÁVEL (1) or DECLÍNIO (2) in a single pass.
+        Variations between the stability band and the growth limit (and missing variations) are left unclassified (-1).
+
+        :param values: Percentage variations (fractions)
+        :param growthLimit: Variation above which a row is classified as growth
+        :param stableBand: Upper bound of the non-negative variations classified as stable
+        :return: Tuple with the trend code of each row and the number of rows in each trend
+        """
+        codes = np.select([values > growthLimit, (values >= 0) & (values <= stableBand), values < 0], [0, 1, 2], default=-1)
+        counts = np.bincount(codes[codes >= 0], minlength=len(TREND_NAMES))
+        return codes, counts
+
+    def rankTrends(self, values: np.ndarray, stableBand: float, count: int) -> Dict[str, np.ndarray]:
+        """
+        Select the positions of the largest variations of each trend with a single partial sort.
+        The trends cover disjoint ranges of the variation, so in descending order each one is a contiguous segment
+        and one argpartition with a cut at the end of every segment's top places all of them at once.
+        Ties are resolved by position, as in DataFrame.nlargest with keep='first'.
+
+        :param values: Percentage variations (fractions)
+        :param stableBand: Upper bound of the non-negative variations classified as stable
+        :param count: Number of positions to select for each trend
+        :return: Dictionary with the positions of each trend, from the largest to the smallest variation
+        """
+        codes, counts = self.classifyTrends(values, stableBand, stableBand)
+        classified = np.flatnonzero(codes >= 0)
+        keys = -values[classified]
+        starts = np.r_[0, np.cumsum(counts)[:-1]]
+        selected = np.minimum(counts, count)
+        cuts = (starts + selected - 1)[selected > 0]
+        partition = np.argpartition(keys, cuts) if len(cuts) else np.empty(0, dtype=int)
+
+        ranked = {}
+        for code, trend in enumerate(TREND_NAMES):
+            if not selected[code]:
+                ranked[trend] = np.empty(0, dtype=int)
+                continue
+            # Every value of the trend tied with the last selected one stays a candidate, so ties are broken by position
+            threshold = keys[partition[starts[code] + selected[code] - 1]]
+            candidates = np.flatnonzero((codes[classified] == code) & (keys <= threshold))
+            ranked[trend] = classified[candidates[np.lexsort((candidates, keys[candidates]))][:count]]
+        return ranked
+
+    def prepareTopTrends(self, df: pd.DataFrame, startYear: str, endYear: str, varPctCol: str, varAbsCol: str) -> Dict[str, pd.DataFrame]:
         """
-        Identify contributors with zero movement over the years.
+        Prepare top trends for growth, stability, and decline.
 
         :param df: DataFrame containing data to be analyzed
-        :return: DataFrame with contributors with zero movement
+        :param startYear: Starting year for the calculation
+        :param endYear: Ending year for the calculation
+        :param varPctCol: Column name for percentage variation
+        :param varAbsCol: Column name for absolute variation
+        :return: Dictionary containing DataFrames for each trend
         """
-        zeroMovement = df[df.filter(regex='^20(1[7-9]|2[0-3])').sum(axis=1) == 0][['RazSoc', 'InscEst']].reset_index(drop=True)
-        zeroMovement.columns = ['NOME / RAZÃO SOCIAL', 'InscEst']
-        return zeroMovement
+        trendLimit = int(self.config['ANALYSIS']['TrendLimit'])
+        stableBand = float(self.config['ANALYSIS']['StableVariationBand']) / 100
+        columns = ['RazSoc', 'InscEst', startYear, endYear, varPctCol, varAbsCol]
+        titles = ['NOME / RAZÃO SOCIAL', 'InscEst', f'Valor {startYear}', f'Valor {endYear}', 'Variação %', 'Variação R$']
+        ranked = self.rankTrends(df[varPctCol].to_numpy(dtype=float), stableBand, trendLimit)
+        # A single positional take per trend, with the titles set on the new frame (no renaming of a slice)
+        return {trend: df[columns].take(positions).set_axis(titles, axis=1) for trend, positions in ranked.items()}
 
     def updateExcel(self, sheet, *args):
         """
@@ -279,14 +526,14 @@ class DataAnalyzer:
             # Write the title
             cellTitle = sheet.cell(row=row, column=1, value=title)
             cellTitle.font = self.getFontConfiguration('title3')
-            cellTitle.alignment = Alignment(horizontal='left', vertical='center')
+            cellTitle.alignment = self.styleRegistry['alignments']['left']
             row += 1
 
             # Process the data
             if title == "TOTAL DE CONTRIBUINTES":
                 cellValue = sheet.cell(row=row-1, column=2, value=int(arg))
                 cellValue.font = self.getFontConfiguration('normal')
-                cellValue.number_format = '0'  # Integer number format
+                cellValue.number_format = self.styleRegistry['numberFormats']['integer']
             elif isinstance(arg, pd.DataFrame):
                 row = self.processDataFrame(sheet, row, title, arg)
             elif isinstance(arg, pd.Series):
@@ -312,57 +559,78 @@ class DataAnalyzer:
 
         :param workbook: Excel workbook where styles will be added
         """
-        if "accounting_style" not in workbook.named_styles:
-            accountingStyle = NamedStyle(name="accounting_style")
-            accountingStyle.number_format = self.config['FORMATTING']['accounting_format']
-            workbook.add_named_style(accountingStyle)
+        if workbook is not self.styleWorkbook:
+            # Style records are per workbook: prototypes from another workbook cannot be reused
+            self.styleWorkbook = workbook
+            self.stylePrototypes = {}
 
-        if "percent_style" not in workbook.named_styles:
-            percentStyle = NamedStyle(name="percent_style")
-            percentStyle.number_format = self.config['FORMATTING']['percent_format']
-            workbook.add_named_style(percentStyle)
+        for styleName in ("accounting_style", "percent_style"):
+            if styleName not in workbook.named_styles:
+                namedStyle = NamedStyle(name=styleName)
+                namedStyle.number_format = self.styleRegistry['numberFormats'][styleName]
+                workbook.add_named_style(namedStyle)
+
+    def buildStyleRegistry(self) -> Dict[str, Dict]:
+        """
+        Build the style registry once per analyzer, so that cell writes never parse the configuration
+        or construct style objects.
+
+        :return: Dictionary with the interned 'fonts', 'alignments' and 'numberFormats', keyed by style type
+        """
+        fontSizes = {
+            'normal': 'font_size_normal',
+            'title1': 'font_size_title1',
+            'title2': 'font_size_title2',
+            'title3': 'font_size_title3'
+        }
+        fonts = {}
+        for styleType, sizeKey in fontSizes.items():
+            isTitle = styleType != 'normal'
+            fonts[styleType] = Font(
+                name=self.config.get('FORMATTING', 'font_title' if isTitle else 'font_normal'),
+                size=self.config.getint('FORMATTING', sizeKey),
+                bold=self.config.getboolean('FORMATTING', 'font_style_bold' if isTitle else 'font_style_normal'),
+                italic=False
+            )
+
+        alignments = {
+            'left': Alignment(horizontal='left', vertical='center'),
+            'center': Alignment(horizontal='center', vertical='center'),
+            'leftShrink': Alignment(horizontal='left', vertical='center', shrink_to_fit=True)
+        }
+
+        numberFormats = {
+            'accounting_style': self.config['FORMATTING']['accounting_format'],
+            'percent_style': self.config['FORMATTING']['percent_format'],
+            'integer': '0'
+        }
+
+        return {'fonts': fonts, 'alignments': alignments, 'numberFormats': numberFormats}
 
     def getFontConfiguration(self, styleType: str = 'normal') -> Font:
         """
         Get font configuration based on the style type.
 
         :param styleType: Style type ('normal', 'title1', 'title2', 'title3')
-        :return: Font object with specified configuration
-        """
-        fontConfig = {
-            'normal': {
-                'font': self.config.get('FORMATTING', 'font_normal'),
-                'size': self.config.getint('FORMATTING', 'font_size_normal'),
-                'bold': self.config.getboolean('FORMATTING', 'font_style_normal'),
-                'italic': False
-            },
-            'title1': {
-                'font': self.config.get('FORMATTING', 'font_title'),
-                'size': self.config.getint('FORMATTING', 'font_size_title1'),
-                'bold': self.config.getboolean('FORMATTING', 'font_style_bold'),
-                'italic': False
-            },
-            'title2': {
-                'font': self.config.get('FORMATTING', 'font_title'),
-                'size': self.config.getint('FORMATTING', 'font_size_title2'),
-                'bold': self.config.getboolean('FORMATTING', 'font_style_bold'),
-                'italic': False
-            },
-            'title3': {
-                'font': self.config.get('FORMATTING', 'font_title'),
-                'size': self.config.getint('FORMATTING', 'font_size_title3'),
-                'bold': self.config.getboolean('FORMATTING', 'font_style_bold'),
-                'italic': False
-            }
-        }
+        :return: Interned Font object from the style registry
+        """
+        return self.styleRegistry['fonts'][styleType]
+
+    def applyNamedStyle(self, cell, styleName: str):
+        """
+        Apply a named style with the normal font to a cell, reusing the style record of the first cell
+        styled this way in the workbook.
 
-        config = fontConfig[styleType]
-        return Font(
-            name=config['font'],
-            size=config['size'],
-            bold=config['bold'],
-            italic=config['italic']
-        )        
+        :param cell: Cell to which the style will be applied
+        :param styleName: Name of the workbook named style ('accounting_style' or 'percent_style')
+        """
+        prototype = self.stylePrototypes.get(styleName)
+        if prototype is None:
+            cell.style = styleName
+            cell.font = self.styleRegistry['fonts']['normal']
+            self.stylePrototypes[styleName] = copy(cell._style)
+        else:
+            cell._style = copy(prototype)
 
     def getTitles(self, data):
         """
@@ -374,6 +642,8 @@ class DataAnalyzer:
         allYears = sorted([int(col) for col in data.index if col.isdigit()])
         firstYear = self.config['ANALYSIS']['InitialYear']
         lastYear, penultimateYear = str(allYears[-1]), str(allYears[-2])
+        movingWindow = self.config.getint('ANALYSIS', 'MovingAverageWindow', fallback=3)
+        movingFirstYear = allYears[max(1, min(movingWindow, len(allYears))) - 1]
         return [
             "VALOR TOTAL AGREGADO POR ANO",
             "TOTAL DE CONTRIBUINTES",
@@ -381,6 +651,8 @@ class DataAnalyzer:
             f"DESVIO PADRÃO {firstYear} - {lastYear}",  # Modificado
             f"TENDÊNCIA {penultimateYear} / {lastYear}",
             f"TENDÊNCIA {firstYear} / {lastYear}",
+            f"MÉDIA MÓVEL DE {movingWindow} ANOS {movingFirstYear} / {lastYear}",
+            f"TENDÊNCIA LINEAR {firstYear} - {lastYear} (MÍNIMOS QUADRADOS)",
             "PRINCIPAIS CONTRIBUINTES",
             f"CONTRIBUINTES SEM MOVIMENTAÇÃO DE {firstYear} À {lastYear}"
         ]
@@ -398,7 +670,7 @@ class DataAnalyzer:
         logging.debug(f"Processing section: {title}")
         cell = sheet.cell(row=row, column=1, value=title)
         cell.font = self.getFontConfiguration('title2')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.alignment = self.styleRegistry['alignments']['center']
         row += 1
 
         if isinstance(arg, pd.DataFrame):
@@ -431,15 +703,10 @@ class DataAnalyzer:
         for col, columnName in enumerate(df.columns, start=1):
             cell = sheet.cell(row=row, column=col, value=columnName.upper())
             cell.font = self.getFontConfiguration('title3')
-            cell.alignment = Alignment(horizontal='center', vertical='center')
+            cell.alignment = self.styleRegistry['alignments']['center']
         row += 1
 
-        for _, data in df.iterrows():
-            for col, value in enumerate(data, start=1):
-                cell = sheet.cell(row=row, column=col, value=value)
-                cell.font = self.getFontConfiguration('normal')
-                self.applyStyle(cell, df.columns[col-1], title)
-            row += 1
+        row = self.writeBlock(sheet, df, row, 1, self.columnStyleSpec(df.columns, title))
 
         # Add explanatory note for standard deviation
         if "DESVIO PADRÃO" in title:
@@ -451,6 +718,40 @@ class DataAnalyzer:
 
         return row
 
+    def columnStyleSpec(self, columns, title) -> List[Optional[str]]:
+        """
+        Resolve the named style of each column of a section once, before any cell is written.
+
+        :param columns: Column names of the block
+        :param title: Title of the section containing the block
+        :return: List with the named style (or None for the plain normal font) of each column
+        """
+        return [self.classifyStyle(columnName, title) for columnName in columns]
+
+    def writeBlock(self, sheet, df: pd.DataFrame, anchorRow: int, anchorCol: int, styleSpec: List[Optional[str]]) -> int:
+        """
+        Write the rows of a DataFrame as a block, with styles resolved per column rather than per cell.
+
+        :param sheet: Excel sheet to be updated
+        :param df: DataFrame whose values (without header or index) will be written
+        :param anchorRow: Row of the top-left cell of the block
+        :param anchorCol: Column of the top-left cell of the block
+        :param styleSpec: Named style of each column, as returned by columnStyleSpec
+        :return: Row number right after the block
+        """
+        normalFont = self.getFontConfiguration('normal')
+        columns = list(enumerate(styleSpec, start=anchorCol))
+        row = anchorRow
+        for values in df.itertuples(index=False, name=None):
+            for (col, styleName), value in zip(columns, values):
+                cell = sheet.cell(row=row, column=col, value=value)
+                if styleName is None:
+                    cell.font = normalFont
+                else:
+                    self.applyNamedStyle(cell, styleName)
+            row += 1
+        return row
+
     def processSeries(self, sheet, row, title, series):
         """
         Process a Series and insert it into the Excel sheet.
@@ -488,7 +789,7 @@ class DataAnalyzer:
         if title == "TOTAL DE CONTRIBUINTES":
             cellValue = sheet.cell(row=row, column=2, value=int(value))  # Convert to integer
             cellValue.font = self.getFontConfiguration('normal')
-            cellValue.number_format = '0'  # Integer number format
+            cellValue.number_format = self.styleRegistry['numberFormats']['integer']
         else:
             cellValue = sheet.cell(row=row, column=1, value=value)
             cellValue.font = self.getFontConfiguration('normal')
@@ -507,13 +808,13 @@ class DataAnalyzer:
         :return: Updated row number after processing
         """
         logging.debug(f"Processing dictionary for {title}")
-        if title.startswith("TENDÊNCIA"):
+        if any(isinstance(value, pd.DataFrame) for value in arg.values()):
             for trend, df in arg.items():
                 if trend in ["ESTÁVEL", "DECLÍNIO"]:
                     row += 2
                 trendCell = sheet.cell(row=row, column=1, value=trend.upper())
                 trendCell.font = self.getFontConfiguration('title3')
-                trendCell.alignment = Alignment(horizontal='center', vertical='center')
+                trendCell.alignment = self.styleRegistry['alignments']['center']
                 row += 1
                 if isinstance(df, pd.DataFrame):
                     row = self.processDataFrame(sheet, row, trend, df)
@@ -535,26 +836,33 @@ class DataAnalyzer:
         :param columnName: Name of the column containing the cell
         :param title: Title of the section containing the cell
         """
-        columnName = self.normalizeString(columnName)
-        title = self.normalizeString(title)
-        
-        logging.debug(f"Applying style for: {columnName} (title: {title})")
-        
-        for keyword in self.formatKeywords['monetary_keywords']:
-            if self.normalizeString(keyword) in columnName or self.normalizeString(keyword) in title:
-                logging.debug(f"Monetary style applied for: {columnName}")
-                cell.style = 'accounting_style'
-                cell.font = self.getFontConfiguration('normal')
-                return
-        
-        for keyword in self.formatKeywords['percentage_keywords']:
-            if self.normalizeString(keyword) in columnName or self.normalizeString(keyword) in title:
-                logging.debug(f"Percentage style applied for: {columnName}")
-                cell.style = 'percent_style'
-                cell.font = self.getFontConfiguration('normal')
-                return
-        
-        logging.debug(f"No specific style applied for: {columnName}")
+        styleName = self.classifyStyle(columnName, title)
+        if styleName is not None:
+            self.applyNamedStyle(cell, styleName)
+
+    def classifyStyle(self, columnName, title) -> Optional[str]:
+        """
+        Decide the named style for a (column, section) pair. Each distinct pair is classified once per run.
+
+        :param columnName: Name of the column containing the cell
+        :param title: Title of the section containing the cell
+        :return: 'accounting_style', 'percent_style' or None when no specific style applies
+        """
+        key = (columnName, title)
+        if key in self.styleDecisions:
+            return self.styleDecisions[key]
+
+        normalizedColumn = self.normalizeString(columnName)
+        normalizedTitle = self.normalizeString(title)
+        styleName = None
+        for candidate, pattern in self.keywordPatterns.items():
+            if pattern.search(normalizedColumn) or pattern.search(normalizedTitle):
+                styleName = candidate
+                break
+
+        logging.debug("Style for %s (title: %s): %s", normalizedColumn, normalizedTitle, styleName)
+        self.styleDecisions[key] = styleName
+        return styleName
 
     def normalizeString(self, s):
         """
@@ -576,7 +884,7 @@ class DataAnalyzer:
 
         sheet.column_dimensions['A'].width = 51
         for cell in sheet['A']:
-            cell.alignment = Alignment(horizontal='left', vertical='center', shrink_to_fit=True)
+            cell.alignment = self.styleRegistry['alignments']['leftShrink']
 
         sheet.page_setup.orientation = 'landscape'
         sheet.page_margins = PageMargins(left=0.3, right=0, top=0.3, bottom=0, header=0.1, footer=0)
@@ -589,6 +897,21 @@ class DataAnalyzer:
         sheet.oddHeader.center.size = 8  # Font size
         sheet.oddHeader.center.font = "Arial"
 
+def renderAnaliseWorkbook(projectRoot: str, config: configparser.ConfigParser, stats: Dict, outputPath: str) -> None:
+    """
+    Render the Analise sheet of one municipality into a standalone workbook (runs in a worker process).
+
+    :param projectRoot: Root directory of the project
+    :param config: ConfigParser object containing configuration settings
+    :param stats: Statistics of the municipality, as returned by DataAnalyzer.computeStatistics
+    :param outputPath: Path of the workbook to be written
+    """
+    analyzer = DataAnalyzer(projectRoot, config)
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    analyzer.analyzeMunicipio(stats, workbook)
+    workbook.save(outputPath)
+
 def main():
     """
     Main function to setup the DataAnalyzer and start the data analysis process.
@@ -597,6 +920,9 @@ def main():
     config = configparser.ConfigParser()
     config.read(os.path.join(projectRoot, "resources", "Config.ini"))
     analyzer = DataAnalyzer(projectRoot, config)
+    if config.get('PERFORMANCE', 'OutputMode', fallback='single') == 'sharded':
+        analyzer.analyzeShards(os.path.join(projectRoot, config['DEFAULT']['OutputDirectory']))
+        return
     excelFile = os.path.join(projectRoot, 
                              config['DEFAULT']['OutputDirectory'], 
                              config['DEFAULT']['OutputFileName'])
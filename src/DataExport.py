@@ -0,0 +1,50 @@
+# DataExport.py
+import configparser
+import importlib.util
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import pandas as pd
+
+def parquet_available() -> bool:
+    """Indica se o motor de Parquet do pandas (pyarrow) está disponível."""
+    return importlib.util.find_spec('pyarrow') is not None
+
+class ParquetExporter:
+    def __init__(self, config: configparser.ConfigParser, project_root: Path):
+        """Inicializa a exportação colunar das tabelas processadas para o diretório [PERFORMANCE] ParquetDirectory."""
+        self.config = config
+        self.output_dir = project_root / self.config.get('PERFORMANCE', 'ParquetDirectory', fallback='data/parquet')
+
+    def export(self, df_unified: pd.DataFrame, df_evol: pd.DataFrame, df_analysis: Dict[str, pd.DataFrame]) -> None:
+        """Grava TAB_Unificada (particionada por SigMun e ANO), TAB_EvolRazSoc e as variações (por SigMun) em Parquet."""
+        start_time = time.time()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        unified = df_unified[['SigMun', 'MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc', 'ANO', 'VALOR']]
+        self.write_dataset('tab_unificada', unified, ['SigMun', 'ANO'])
+        self.write_dataset('tab_evolrazsoc', df_evol.rename_axis(columns=None), ['SigMun'])
+        if df_analysis:
+            variacoes = pd.concat(df_analysis, names=['SigMun']).reset_index(level='SigMun').reset_index(drop=True)
+            self.write_dataset('variacao', variacoes, ['SigMun'])
+
+        end_time = time.time()
+        logging.info(f"Exportação Parquet concluída em {self.output_dir}. Tempo total: {end_time - start_time:.2f} segundos")
+
+    def write_dataset(self, name: str, df: pd.DataFrame, partition_cols: List[str]) -> None:
+        """Grava um conjunto de dados particionado, substituindo por inteiro o conjunto da execução anterior."""
+        # Colunas de texto de baixa cardinalidade viram categorias (dicionário no Parquet)
+        df = df.astype({column: 'category' for column in ('SigMun', 'MUNICIPIO') if column in df.columns})
+        dataset_dir = self.output_dir / name
+        tmp_dir = self.output_dir / f".{name}.tmp"
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        df.to_parquet(tmp_dir, engine='pyarrow', partition_cols=partition_cols, index=False)
+        if dataset_dir.exists():
+            shutil.rmtree(dataset_dir)
+        os.replace(tmp_dir, dataset_dir)
+        logging.info(f"Conjunto Parquet {name} gravado: {len(df)} linhas, partições por {', '.join(partition_cols)}")
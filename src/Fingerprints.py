@@ -0,0 +1,84 @@
+# Fingerprints.py
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List
+
+import pandas as pd
+
+# Manifesto com a impressão digital dos dados de cada shard (modo OutputMode = sharded)
+SHARD_MANIFEST = 'Tabula_shards.json'
+
+def frame_fingerprint(*frames: pd.DataFrame, salt: str = '') -> str:
+    """Impressão digital (SHA-256) do conteúdo, colunas e tipos de um ou mais DataFrames."""
+    digest = hashlib.sha256(salt.encode('utf-8'))
+    for df in frames:
+        digest.update(json.dumps([str(column) for column in df.columns]).encode('utf-8'))
+        digest.update(json.dumps([str(dtype) for dtype in df.dtypes]).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+# Incrementar sempre que a forma de gravar as abas Variacao/Analise mudar (invalida as impressões digitais gravadas)
+SHEET_FORMAT_VERSION = 1
+
+class SheetFingerprints:
+    def __init__(self, workbook_path: str):
+        """Impressões digitais dos dados de cada aba Variacao/Analise de um workbook, em um JSON ao lado dele (<arquivo>.abas.json)."""
+        self.workbook_path = workbook_path
+        self.manifest_path = f"{os.path.splitext(workbook_path)[0]}.abas.json"
+        self.sheets: Dict[str, str] = self._load()
+
+    def _load(self) -> Dict[str, str]:
+        """Carrega as impressões digitais, descartando-as se o workbook foi alterado depois da última gravação registrada."""
+        if not os.path.exists(self.manifest_path) or not os.path.exists(self.workbook_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Manifesto das abas ilegível, todas as abas serão regravadas: {e}")
+            return {}
+        stat = os.stat(self.workbook_path)
+        if (manifest.get('version'), manifest.get('size'), manifest.get('mtime_ns')) != (SHEET_FORMAT_VERSION, stat.st_size, stat.st_mtime_ns):
+            logging.info(f"{os.path.basename(self.workbook_path)} alterado desde a última gravação registrada: todas as abas serão regravadas.")
+            return {}
+        return manifest.get('sheets', {})
+
+    def unchanged(self, sheet_name: str, fingerprint: str, sheetnames: List[str]) -> bool:
+        """Indica, sem registrar nada, se a aba existe e foi gravada com a mesma impressão digital."""
+        return self.sheets.get(sheet_name) == fingerprint and sheet_name in sheetnames
+
+    def changed(self, sheet_name: str, fingerprint: str, sheetnames: List[str]) -> bool:
+        """Indica se a aba precisa ser regravada (dados ou configuração diferentes, ou aba ausente) e registra a nova impressão digital."""
+        if self.unchanged(sheet_name, fingerprint, sheetnames):
+            return False
+        self.sheets[sheet_name] = fingerprint
+        return True
+
+    def save(self) -> None:
+        """Grava o manifesto de forma atômica, com o tamanho e o mtime do workbook recém-salvo."""
+        stat = os.stat(self.workbook_path)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': SHEET_FORMAT_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                       'sheets': self.sheets}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+def load_shard_manifest(manifest_path: str) -> Dict[str, str]:
+    """Carrega as impressões digitais dos shards gravados anteriormente."""
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Manifesto dos shards ilegível, todos os shards serão regravados: {e}")
+        return {}
+
+def save_shard_manifest(manifest_path: str, fingerprints: Dict[str, str]) -> None:
+    """Grava o manifesto dos shards de forma atômica."""
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(fingerprints, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
@@ -0,0 +1,143 @@
+# IngestCache.py
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# Incrementar sempre que o formato do quadro gerado na leitura mudar
+CACHE_FORMAT_VERSION = 4
+MANIFEST_NAME = 'manifest.json'
+
+def cache_available() -> bool:
+    """Indica se o formato colunar do cache (Feather, via pyarrow) está disponível."""
+    return importlib.util.find_spec('pyarrow') is not None
+
+def file_digest(file_path: Path, chunk_size: int = 1 << 20) -> str:
+    """Calcula o hash SHA-256 do conteúdo de um arquivo, lendo-o em blocos."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class IngestCache:
+    def __init__(self, cache_dir: Path, max_bytes: int, salt: str = ''):
+        """Inicializa o cache de leitura dos CSV (quadros lidos em Feather e um manifesto JSON em cache_dir)."""
+        # Entradas são identificadas pelo caminho do CSV e validadas por tamanho, mtime e hash do conteúdo;
+        # o salt muda sempre que algo que influencia o quadro gerado (ex.: o mapa de SigMun) mudar
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.salt = f"{CACHE_FORMAT_VERSION}:{salt}"
+        self.hits = 0
+        self.misses = 0
+        self.entries: Dict[str, dict] = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        """Carrega o manifesto do cache, descartando-o se estiver corrompido ou tiver sido gerado com outro salt."""
+        manifest_path = self.cache_dir / MANIFEST_NAME
+        if not manifest_path.exists():
+            return {}
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Manifesto do cache de leitura ilegível, cache será reconstruído: {e}")
+            return {}
+        if manifest.get('salt') != self.salt:
+            logging.info("Cache de leitura gerado com outra versão/configuração; entradas descartadas.")
+            for entry in manifest.get('entries', {}).values():
+                (self.cache_dir / entry['cache_file']).unlink(missing_ok=True)
+            return {}
+        return manifest.get('entries', {})
+
+    def clear(self) -> None:
+        """Remove todas as entradas do cache (usado por --rebuild-cache)."""
+        for entry in self.entries.values():
+            (self.cache_dir / entry['cache_file']).unlink(missing_ok=True)
+        self.entries = {}
+        logging.info(f"Cache de leitura limpo: {self.cache_dir}")
+
+    def get(self, file_path: Path) -> Optional[Tuple[pd.DataFrame, List[str], int]]:
+        """Retorna o quadro lido, os municípios não resolvidos e as linhas sem inscrição descartadas de um CSV inalterado, ou None."""
+        key = str(Path(file_path).resolve())
+        entry = self.entries.get(key)
+        stat = os.stat(file_path)
+        if entry is not None and (entry['size'], entry['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            # Tamanho/mtime diferentes: só reaproveita se o conteúdo for de fato o mesmo
+            if entry['size'] == stat.st_size and entry['sha256'] == file_digest(file_path):
+                entry['mtime_ns'] = stat.st_mtime_ns
+            else:
+                entry = None
+
+        cache_file = self.cache_dir / entry['cache_file'] if entry is not None else None
+        if cache_file is None or not cache_file.exists():
+            self.misses += 1
+            return None
+
+        try:
+            frame = pd.read_feather(cache_file)
+        except Exception as e:
+            logging.warning(f"Entrada do cache ilegível para {Path(file_path).name}, arquivo será relido: {e}")
+            self.misses += 1
+            return None
+
+        entry['last_used'] = time.time()
+        self.hits += 1
+        return frame, entry.get('unresolved', []), entry.get('missing_insc_est', 0)
+
+    def put(self, file_path: Path, frame: pd.DataFrame, unresolved: List[str], missing_insc_est: int = 0) -> None:
+        """Armazena o quadro gerado a partir de um CSV."""
+        key = str(Path(file_path).resolve())
+        stat = os.stat(file_path)
+        digest = file_digest(file_path)
+        cache_file = f"{digest}.feather"
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        frame.reset_index(drop=True).to_feather(self.cache_dir / cache_file)
+
+        previous = self.entries.get(key)
+        self.entries[key] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest,
+            'cache_file': cache_file,
+            'bytes': (self.cache_dir / cache_file).stat().st_size,
+            'unresolved': unresolved,
+            'missing_insc_est': missing_insc_est,
+            'last_used': time.time()
+        }
+        if previous is not None and previous['cache_file'] != cache_file:
+            self._remove_orphan(previous['cache_file'])
+
+    def _remove_orphan(self, cache_file: str) -> None:
+        """Apaga um arquivo do cache que não é mais referenciado por nenhuma entrada."""
+        if all(entry['cache_file'] != cache_file for entry in self.entries.values()):
+            (self.cache_dir / cache_file).unlink(missing_ok=True)
+
+    def evict(self) -> None:
+        """Remove as entradas menos usadas recentemente até o cache caber no limite de tamanho."""
+        total = sum(entry['bytes'] for entry in self.entries.values())
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            del self.entries[key]
+            self._remove_orphan(entry['cache_file'])
+            total -= entry['bytes']
+            logging.info(f"Cache de leitura: entrada removida por limite de tamanho ({Path(key).name})")
+
+    def save(self) -> None:
+        """Aplica a política de tamanho e grava o manifesto de forma atômica."""
+        self.evict()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.cache_dir / MANIFEST_NAME
+        tmp_path = manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'salt': self.salt, 'entries': self.entries}, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+        logging.info(f"Cache de leitura: {self.hits} acertos, {self.misses} falhas, {len(self.entries)} entradas")
@@ -0,0 +1,164 @@
+# Instrumentation.py
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def configure_logging(log_path: Path) -> None:
+    """Configura uma única vez o logger raiz, com um só arquivo de log para todas as etapas da execução."""
+    root = logging.getLogger()
+    if root.handlers:
+        # Já configurado (ex.: pelo benchmark ou por quem importou o pacote): mantém a configuração existente
+        return
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(filename=log_path, level=logging.INFO, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+def peak_memory_mb() -> Optional[float]:
+    """Retorna o pico de memória residente do processo em MB (None se indisponível na plataforma)."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss é reportado em bytes no macOS e em KB no Linux
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+def current_memory_mb() -> Optional[float]:
+    """Retorna a memória residente atual do processo em MB (None se indisponível na plataforma)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / 2**20
+
+class Span:
+    def __init__(self, name: str, parent: Optional['Span'], rows: Optional[int], attributes: Dict):
+        """Medição de uma etapa: tempo de parede, tempo de CPU, linhas processadas e variação de memória."""
+        self.name = name
+        self.path = f"{parent.path}/{name}" if parent is not None else name
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.rows = rows
+        self.attributes = attributes
+        self.wall = self.cpu = 0.0
+        self.memory_delta: Optional[float] = None
+        self.peak_memory: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def as_dict(self) -> Dict:
+        """Representação do span no relatório da execução."""
+        record = {'name': self.name, 'path': self.path, 'depth': self.depth,
+                  'wall_seconds': round(self.wall, 4), 'cpu_seconds': round(self.cpu, 4), 'rows': self.rows,
+                  'rows_per_second': round(self.rows / self.wall, 1) if self.rows and self.wall > 0 else None,
+                  'memory_delta_mb': round(self.memory_delta, 2) if self.memory_delta is not None else None,
+                  'peak_memory_mb': round(self.peak_memory, 2) if self.peak_memory is not None else None}
+        if self.attributes:
+            record['attributes'] = self.attributes
+        if self.error:
+            record['error'] = self.error
+        return record
+
+class RunMetrics:
+    def __init__(self):
+        """Registro dos spans de uma execução, na ordem em que terminam (etapas internas antes da etapa que as contém)."""
+        self.spans: List[Span] = []
+        self._stack: List[Span] = []
+        self.started = datetime.now()
+        self._start = time.perf_counter()
+
+    def reset(self) -> None:
+        """Descarta os spans registrados e reinicia o relógio da execução."""
+        self.__init__()
+
+    @contextmanager
+    def span(self, name: str, rows: Optional[int] = None, **attributes) -> Iterator[Span]:
+        """Mede o bloco como uma etapa; as linhas processadas podem ser informadas depois, em span.rows."""
+        record = Span(name, self._stack[-1] if self._stack else None, rows, attributes)
+        self._stack.append(record)
+        memory_before = current_memory_mb()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        except BaseException as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record.wall = time.perf_counter() - wall_start
+            record.cpu = time.process_time() - cpu_start
+            memory_after = current_memory_mb()
+            if memory_before is not None and memory_after is not None:
+                record.memory_delta = memory_after - memory_before
+            record.peak_memory = peak_memory_mb()
+            self._stack.pop()
+            self.spans.append(record)
+            logging.debug(f"Etapa {record.path}: {record.wall:.3f} s (CPU {record.cpu:.3f} s), linhas: {record.rows}")
+
+    def report(self, **extra) -> Dict:
+        """Relatório da execução: spans, totais e informações adicionais (ex.: configuração e perfil)."""
+        return {'started': self.started.isoformat(timespec='seconds'),
+                'wall_seconds': round(time.perf_counter() - self._start, 4),
+                'peak_memory_mb': peak_memory_mb(),
+                'spans': [span.as_dict() for span in self.spans],
+                **extra}
+
+    def save(self, report_path: Path, **extra) -> None:
+        """Grava o relatório da execução em JSON."""
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = report_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(**extra), f, indent=2, ensure_ascii=False, default=str)
+        os.replace(tmp_path, report_path)
+        logging.info(f"Relatório da execução gravado em {report_path}")
+
+# Registro único da execução (etapas executadas em processos auxiliares não são registradas)
+metrics = RunMetrics()
+
+def span(name: str, rows: Optional[int] = None, **attributes):
+    """Atalho para metrics.span: mede um bloco da execução atual."""
+    return metrics.span(name, rows, **attributes)
+
+@contextmanager
+def profiled(output_path: Optional[Path], top: int = 40) -> Iterator[Optional[cProfile.Profile]]:
+    """Executa o bloco sob cProfile (se output_path) e grava o perfil em pstats e um resumo em texto das funções mais custosas."""
+    if output_path is None:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(output_path)
+        with open(output_path.with_suffix('.txt'), 'w', encoding='utf-8') as f:
+            stats = pstats.Stats(profiler, stream=f)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+        logging.info(f"Perfil da execução gravado em {output_path} (resumo em {output_path.with_suffix('.txt')})")
+
+def hot_functions(profiler: cProfile.Profile, top: int = 25) -> List[Dict]:
+    """Funções com maior tempo próprio no perfil, para o relatório da execução."""
+    stats = pstats.Stats(profiler).stats
+    ranked = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return [{'function': f"{Path(filename).name}:{line}({name})", 'calls': calls, 'own_seconds': round(own, 4),
+             'cumulative_seconds': round(cumulative, 4)}
+            for (filename, line, name), (_, calls, own, cumulative, _) in ranked]
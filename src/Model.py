@@ -2,135 +2,390 @@
 import pandas as pd
 import numpy as np
 import json
+import os
+import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import configparser
 import logging
 import time
+import unicodedata
+from src.Instrumentation import peak_memory_mb, span
+from src.YearMatrix import TaxpayerYearMatrix
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow é opcional: sem ele a leitura usa o engine C do pandas
+    pa = None
+
+CSV_ENCODING = 'iso-8859-1'
+CSV_SEPARATOR = ';'
+# Colunas de identificação aproveitadas do layout DECLAN e seus nomes no modelo
+ID_COLUMNS = {'Inscricao': 'InscEst', 'CPF_CNPJ': 'CPF_CNPJ', 'Nome': 'RazSoc', 'Nome_Cidade': 'MUNICIPIO'}
+YEAR_COLUMN_PATTERN = re.compile(r'^(\d{4})\(R\$\)$')
+# Esquema compacto do quadro longo: textos repetidos como categorias (códigos inteiros), ano e inscrição como inteiros
+CATEGORY_COLUMNS = ['MUNICIPIO', 'SigMun', 'RazSoc', 'CPF_CNPJ']
+YEAR_DTYPE = 'int16'
+# Arquivos de entrada nomeados pelo SigMun do município: XXX_VarAnual-AAAAaAAAA.csv
+INPUT_FILE_PATTERN = re.compile(r'^([A-Za-z0-9]+)_VarAnual-.*\.csv$')
+
+def normalize_mun_name(name: str) -> str:
+    """Normaliza o nome do município (sem acentos, sem distinção de caixa) para comparação."""
+    text = unicodedata.normalize('NFKD', str(name))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.casefold().split())
+
+def memory_report(df: pd.DataFrame) -> str:
+    """Descreve o uso de memória do DataFrame (total e por coluna, incluindo o conteúdo dos textos)."""
+    usage = df.memory_usage(deep=True, index=False) / 2**20
+    columns = ', '.join(f"{column}={mb:.2f}" for column, mb in usage.items())
+    return f"{usage.sum():.2f} MB ({columns})"
+
+def concat_compact(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatena quadros no esquema compacto, unificando antes as categorias para que as colunas continuem categóricas."""
+    # Categorias ordenadas: ordenações e agrupamentos sobre os códigos seguem a ordem alfabética dos textos
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    for column in CATEGORY_COLUMNS:
+        if all(column in frame.columns for frame in frames):
+            categories = sorted(set().union(*(frame[column].cat.categories for frame in frames)))
+            frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+def index_input_files(input_dir: Path) -> Dict[str, List[Path]]:
+    """Indexa os arquivos CSV do diretório de entrada pelo SigMun do prefixo do nome, em ordem de nome."""
+    index: Dict[str, List[Path]] = {}
+    for file in sorted(os.listdir(input_dir)):
+        match = INPUT_FILE_PATTERN.match(file)
+        if match:
+            index.setdefault(match.group(1).upper(), []).append(input_dir / file)
+        elif file.endswith('.csv'):
+            logging.warning(f"Arquivo fora do padrão XXX_VarAnual-*.csv ignorado na consulta por município: {file}")
+    return index
+
+class ParsedFile(NamedTuple):
+    """Resultado da leitura de um arquivo *_VarAnual-*.csv (quadro largo: identificação e uma coluna por ano)."""
+    file_name: str
+    frame: pd.DataFrame
+    unresolved: List[str]
+    missing_insc_est: int
+    elapsed: float
+
+def resolve_sig_mun(municipios: pd.Series, mun_sig_index: Dict[str, str]) -> Tuple[pd.Series, List[str]]:
+    """Resolve o SigMun de cada linha consultando o índice inverso uma única vez por município distinto."""
+    municipios = municipios.astype('category')
+    sig_por_nome = {nome: mun_sig_index.get(normalize_mun_name(nome), '') for nome in municipios.cat.categories}
+    nao_resolvidos = sorted(nome for nome, sig in sig_por_nome.items() if not sig)
+    return municipios.map(sig_por_nome).astype('category'), nao_resolvidos
+
+class CsvLayout(NamedTuple):
+    """Posições (no cabeçalho) e nomes no modelo das colunas aproveitadas de um arquivo DECLAN."""
+    n_columns: int
+    indices: List[int]
+    names: List[str]
+    years: List[str]
+
+def read_header(file_path: Path) -> str:
+    """Lê apenas a linha de cabeçalho de um arquivo CSV."""
+    with open(file_path, 'r', encoding=CSV_ENCODING, newline='') as f:
+        return f.readline().rstrip('\r\n')
+
+@lru_cache(maxsize=None)
+def resolve_layout(header: str) -> CsvLayout:
+    """Resolve, uma vez por cabeçalho distinto, os índices das colunas de identificação e das colunas YYYY(R$)."""
+    columns = [column.strip() for column in header.split(CSV_SEPARATOR)]
+    indices, names, years = [], [], []
+    for idx, column in enumerate(columns):
+        year_match = YEAR_COLUMN_PATTERN.match(column)
+        if column in ID_COLUMNS:
+            names.append(ID_COLUMNS[column])
+        elif year_match:
+            names.append(year_match.group(1))
+            years.append(year_match.group(1))
+        else:
+            continue
+        indices.append(idx)
+
+    missing = [column for column, name in ID_COLUMNS.items() if name not in names]
+    if missing:
+        raise ValueError(f"Colunas obrigatórias ausentes no cabeçalho: {', '.join(missing)}")
+    return CsvLayout(len(columns), indices, names, years)
+
+def strip_excel_text(value: str) -> Optional[str]:
+    """Remove o invólucro ="..." que o Excel usa para preservar zeros à esquerda do CPF/CNPJ."""
+    if not value:
+        return None
+    if value.startswith('="') and value.endswith('"'):
+        return value[2:-1]
+    return value
+
+def _read_csv_pyarrow(file_path: Path, layout: CsvLayout) -> pd.DataFrame:
+    """Lê as colunas do layout com o leitor CSV do pyarrow, convertendo valores e CPF/CNPJ ainda em Arrow."""
+    positional = [f'c{idx}' for idx in range(layout.n_columns)]
+    selected = [positional[idx] for idx in layout.indices]
+    column_types = {column: pa.string() for column in selected}
+    column_types[positional[layout.indices[layout.names.index('MUNICIPIO')]]] = pa.dictionary(pa.int32(), pa.string())
+    column_types[positional[layout.indices[layout.names.index('InscEst')]]] = pa.int64()
+
+    table = pa_csv.read_csv(
+        file_path,
+        read_options=pa_csv.ReadOptions(encoding=CSV_ENCODING, skip_rows=1, column_names=positional),
+        parse_options=pa_csv.ParseOptions(delimiter=CSV_SEPARATOR),
+        convert_options=pa_csv.ConvertOptions(include_columns=selected, column_types=column_types, strings_can_be_null=True)
+    )
+    table = table.rename_columns(layout.names)
+
+    cpf_idx = layout.names.index('CPF_CNPJ')
+    table = table.set_column(cpf_idx, 'CPF_CNPJ', pc.replace_substring_regex(table.column(cpf_idx), pattern=r'^="(.*)"$', replacement=r'\1'))
+    for year in layout.years:
+        # Formato brasileiro: '.' como separador de milhar e ',' como separador decimal
+        idx = layout.names.index(year)
+        values = pc.replace_substring(table.column(idx), pattern='.', replacement='')
+        values = pc.replace_substring(values, pattern=',', replacement='.')
+        table = table.set_column(idx, year, pc.cast(values, pa.float64()))
+
+    return table.to_pandas()
+
+def _read_csv_c(file_path: Path, layout: CsvLayout) -> pd.DataFrame:
+    """Lê as colunas do layout com o engine C do pandas."""
+    by_name = dict(zip(layout.names, layout.indices))
+    dtypes = {idx: 'float64' for idx in (by_name[year] for year in layout.years)}
+    # Inteiro anulável: linhas sem inscrição são descartadas (e informadas) em parse_var_anual
+    dtypes.update({by_name['InscEst']: 'Int64', by_name['RazSoc']: str, by_name['MUNICIPIO']: 'category'})
+
+    df = pd.read_csv(file_path, sep=CSV_SEPARATOR, encoding=CSV_ENCODING, header=None, skiprows=1,
+                     usecols=layout.indices, dtype=dtypes, converters={by_name['CPF_CNPJ']: strip_excel_text},
+                     decimal=',', thousands='.', engine='c')
+    return df.rename(columns=dict(zip(layout.indices, layout.names)))
+
+def read_var_anual(file_path: Path) -> pd.DataFrame:
+    """Lê apenas as colunas de identificação e de valores anuais (nomeadas pelo ano) de um arquivo *_VarAnual-*.csv."""
+    layout = resolve_layout(read_header(file_path))
+    df = None
+    if pa is not None:
+        try:
+            df = _read_csv_pyarrow(file_path, layout)
+        except pa.ArrowInvalid:
+            df = None  # conteúdo fora do padrão esperado pelo pyarrow: repete a leitura com o engine C
+    if df is None:
+        df = _read_csv_c(file_path, layout)
+
+    municipios = df['MUNICIPIO']
+    df['MUNICIPIO'] = municipios.cat.set_categories(sorted(municipios.cat.categories))
+    return df
+
+def parse_var_anual(file_path: Path, mun_sig_index: Dict[str, str]) -> ParsedFile:
+    """Lê um arquivo CSV e resolve SigMun e categorias (não depende do DataModel; executável em processos auxiliares)."""
+    start_time = time.time()
+    df = read_var_anual(file_path)
+    # Sem a inscrição estadual a linha não identifica o contribuinte: descartada e informada por arquivo
+    missing_insc_est = df['InscEst'].isna().to_numpy()
+    if missing_insc_est.any():
+        df = df[~missing_insc_est].reset_index(drop=True)
+    df['InscEst'] = df['InscEst'].astype('int64')
+    df['SigMun'], nao_resolvidos = resolve_sig_mun(df['MUNICIPIO'], mun_sig_index)
+    df['RazSoc'] = df['RazSoc'].astype('category')
+    df['CPF_CNPJ'] = df['CPF_CNPJ'].astype('category')
+
+    # As colunas de valores já vêm nomeadas pelo ano
+    years = [column for column in df.columns if column.isdigit()]
+    df[years] = df[years].fillna(0).round(2)
+
+    return ParsedFile(Path(file_path).name, df, nao_resolvidos, int(missing_insc_est.sum()), time.time() - start_time)
+
+def melt_var_anual(frame: pd.DataFrame) -> pd.DataFrame:
+    """Transforma o quadro largo de um arquivo para o formato longo (uma linha por contribuinte e ano)."""
+    df_melted = frame.melt(id_vars=['MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc', 'SigMun'], var_name='ANO', value_name='VALOR')
+    df_melted['ANO'] = df_melted['ANO'].astype(YEAR_DTYPE)
+    return df_melted
 
 class DataModel:
-    def __init__(self, project_root: Path, config: configparser.ConfigParser):
-        """Inicializa o modelo de dados com configuração e caminho do projeto."""
+    def __init__(self, project_root: Path, config: configparser.ConfigParser, sig_mun: Optional[str] = None):
+        """Inicializa o modelo de dados com configuração e caminho do projeto (sig_mun: carga restrita a um município)."""
         self.project_root = project_root
         self.config = config
+        self.sig_mun = sig_mun
         self.data: pd.DataFrame = pd.DataFrame()
+        self.mun_sig_index: Dict[str, str] = {}
+        self._pending_frames: List[pd.DataFrame] = []
+        self._batch_start: Optional[float] = None
         self.sig_mun_map: Dict[str, str] = self.load_sig_mun_map()
-        
-        logging.basicConfig(filename='data_model.log', level=logging.INFO)
+        # 'matrix': matriz contribuinte × ano (sem formato longo intermediário); 'long': melt → drop_duplicates → pivot_table
+        self.engine = self.config.get('PERFORMANCE', 'DataEngine', fallback='long')
+        self.matrix: Optional[TaxpayerYearMatrix] = None
+        if self.engine == 'matrix':
+            self.matrix = TaxpayerYearMatrix(self.config.get('PERFORMANCE', 'DuplicatePolicy', fallback='first'))
 
     def load_sig_mun_map(self) -> Dict[str, str]:
-        """Carrega o mapa de SigMun a partir de um arquivo JSON."""
-        with open(self.project_root / 'resources' / 'TAB_ApoioSigMun.json', 'r') as f:
-            return json.load(f)
+        """Carrega o mapa de SigMun a partir de um arquivo JSON e monta o índice inverso município → SigMun."""
+        with open(self.project_root / 'resources' / 'TAB_ApoioSigMun.json', 'r', encoding='utf-8') as f:
+            sig_mun_map = json.load(f)
+        self.mun_sig_index = {normalize_mun_name(nome): sig for sig, nome in sig_mun_map.items()}
+        return sig_mun_map
+
+    def begin_batch(self) -> None:
+        """Inicia a carga em lote: os quadros de cada arquivo são acumulados e concatenados uma única vez em end_batch."""
+        self._pending_frames = []
+        self._batch_start = time.time()
+
+    def end_batch(self) -> None:
+        """Materializa o DataFrame principal com uma única concatenação dos quadros acumulados no lote."""
+        if self._batch_start is None:
+            return
+        frames = self._pending_frames if self.data.empty else [self.data] + self._pending_frames
+        if frames:
+            self.data = concat_compact(frames)
+
+        elapsed = time.time() - self._batch_start
+        peak = peak_memory_mb()
+        peak_text = f"{peak:.1f} MB" if peak is not None else "indisponível"
+        if self.matrix is not None:
+            logging.info(f"Carga em lote concluída: {len(self.matrix)} contribuintes na matriz. "
+                         f"Tempo total: {elapsed:.2f} segundos. Pico de memória: {peak_text}")
+            logging.info(f"Memória das células acumuladas para a matriz contribuinte × ano: {self.matrix.memory_mb():.2f} MB")
+        else:
+            logging.info(f"Carga em lote concluída: {len(self._pending_frames)} arquivos, Shape: {self.data.shape}. "
+                         f"Tempo total: {elapsed:.2f} segundos. Pico de memória: {peak_text}")
+            logging.info(f"Memória do DataFrame principal: {memory_report(self.data)}")
+
+        self._pending_frames = []
+        self._batch_start = None
 
     def load_data(self, file_path: Path) -> None:
-        """Carrega dados de um arquivo CSV e os adiciona ao DataFrame principal."""
-        start_time = time.time()
-        cols = ['Inscricao', 'CPF_CNPJ', 'Nome', 'Nome_Cidade']
-        df = pd.read_csv(file_path, sep=';', usecols=lambda x: x in cols or x.endswith('(R$)'), decimal=',', thousands='.', encoding='iso-8859-1')
-        df = df.rename(columns={
-            'Inscricao': 'InscEst',
-            'Nome': 'RazSoc',
-            'Nome_Cidade': 'MUNICIPIO'
-        })
-        df['SigMun'] = df['MUNICIPIO'].map(lambda x: next((k for k, v in self.sig_mun_map.items() if v == x), ''))
-        
-        # Transformação dos dados para formato longo
-        df_melted = df.melt(id_vars=['MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc', 'SigMun'], var_name='ANO', value_name='VALOR')
-        #df_melted['ANO'] = df_melted['ANO'].str.extract('(\d{4})')  # Extrai o ano do nome da coluna
-        df_melted['ANO'] = df_melted['ANO'].str.extract(r'(\d{4})')
-        df_melted['VALOR'] = df_melted['VALOR'].fillna(0).round(2)
-        
-        self.data = pd.concat([self.data, df_melted], ignore_index=True)
-        
-        end_time = time.time()
-        logging.info(f"Dados do arquivo {file_path.name} carregados com sucesso. Shape: {df_melted.shape}. Tempo de processamento: {end_time - start_time:.2f} segundos")
+        """Carrega dados de um arquivo CSV e os adiciona ao DataFrame principal (ou ao lote em andamento)."""
+        self.add_parsed(parse_var_anual(file_path, self.mun_sig_index))
+
+    def add_parsed(self, parsed: 'ParsedFile') -> None:
+        """Adiciona ao DataFrame principal (ou ao lote em andamento) o resultado da leitura de um arquivo."""
+        if parsed.unresolved:
+            logging.warning(f"Municípios sem SigMun em {parsed.file_name}: {', '.join(parsed.unresolved)}")
+        if parsed.missing_insc_est:
+            logging.warning(f"Linhas sem inscrição estadual descartadas em {parsed.file_name}: {parsed.missing_insc_est}")
+        if self.sig_mun is not None:
+            parsed = self.restrict_to_sig_mun(parsed)
+
+        if self.matrix is not None:
+            # Cada arquivo grava seus anos diretamente na matriz, sem passar pelo formato longo
+            self.matrix.add(parsed.frame)
+        elif self._batch_start is not None:
+            self._pending_frames.append(melt_var_anual(parsed.frame))
+        else:
+            self.data = concat_compact([self.data, melt_var_anual(parsed.frame)])
+
+        logging.info(f"Dados do arquivo {parsed.file_name} carregados com sucesso. Shape: {parsed.frame.shape}. Tempo de processamento: {parsed.elapsed:.2f} segundos. "
+                     f"Memória: {memory_report(parsed.frame)}")
+
+    def restrict_to_sig_mun(self, parsed: 'ParsedFile') -> 'ParsedFile':
+        """Mantém apenas as linhas do município consultado (o arquivo é escolhido pelo prefixo do nome, não pelo conteúdo)."""
+        own_rows = (parsed.frame['SigMun'] == self.sig_mun).to_numpy()
+        if own_rows.all():
+            return parsed
+        logging.warning(f"{parsed.file_name}: {int((~own_rows).sum())} linhas de outros municípios descartadas na consulta de {self.sig_mun}")
+        return parsed._replace(frame=parsed.frame[own_rows].reset_index(drop=True))
 
     def remove_duplicates(self) -> None:
         """Remove duplicatas do DataFrame principal."""
+        if self.matrix is not None:
+            # Na matriz, as células repetidas são resolvidas pela política de duplicatas ao materializá-la
+            self.matrix.build()
+            logging.info(f"Memória da matriz contribuinte × ano: {self.matrix.memory_mb():.2f} MB")
+            self.save_reconciliation_report()
+            return
         before_count = len(self.data)
         self.data = self.data.drop_duplicates(subset=['MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc', 'ANO', 'SigMun'], keep='first')
         after_count = len(self.data)
         logging.info(f"Duplicatas removidas. Registros antes: {before_count}, depois: {after_count}")
 
+    def save_reconciliation_report(self) -> None:
+        """Grava o relatório de conciliação das janelas ([PERFORMANCE] ReconciliationReport; vazio = não gravar)."""
+        report_path = self.config.get('PERFORMANCE', 'ReconciliationReport', fallback='')
+        report = self.matrix.report
+        for campo, total in report['Campo'].value_counts().items():
+            logging.warning(f"Conciliação: {total} divergências de {campo} entre janelas (política '{self.matrix.policy}')")
+        if not report_path:
+            return
+        report_file = self.project_root / report_path
+        if self.sig_mun is not None:
+            # Consulta de um município: não sobrescreve o relatório do estado
+            report_file = report_file.with_name(f"{report_file.stem}_{self.sig_mun}{report_file.suffix}")
+        report_file.parent.mkdir(parents=True, exist_ok=True)
+        report.to_csv(report_file, sep=CSV_SEPARATOR, decimal=',', encoding=CSV_ENCODING, errors='replace', index=False)
+        logging.info(f"Relatório de conciliação gravado em {report_file}: {len(report)} divergências")
+
     def process_data(self) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame], pd.DataFrame]:
         """Processa os dados, calculando variações e preparando DataFrames para análise."""
         start_time = time.time()
+
+        with span('tables') as tables:
+            df_unified, df_evol, anos_disponiveis = self.build_tables()
+            tables.rows = len(df_unified)
+        with span('variations', rows=len(df_evol)):
+            df_analysis = self.calculate_variations(df_evol, anos_disponiveis)
         
-        # Criação do DataFrame unificado
-        df_unified = self.data.sort_values(['SigMun', 'MUNICIPIO', 'InscEst', 'ANO'])
-        df_unified = df_unified[['SigMun', 'MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc', 'ANO', 'VALOR']]
+        end_time = time.time()
+        logging.info(f"Processamento de dados concluído. Tempo total: {end_time - start_time:.2f} segundos")
         
-        # Identificação dinâmica dos anos
-        anos_disponiveis = sorted(df_unified['ANO'].unique())
+        return df_unified, df_evol, df_analysis
+
+    def build_tables(self) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
+        """Monta o quadro unificado, o quadro de evolução (contribuinte × ano) e a lista de anos disponíveis."""
+        if self.matrix is not None:
+            # Quadros unificado e de evolução lidos diretamente da matriz contribuinte × ano, sem pivot
+            df_unified, df_evol = self.matrix.tables()
+        else:
+            # Criação do DataFrame unificado
+            df_unified = self.data.sort_values(['SigMun', 'MUNICIPIO', 'InscEst', 'ANO'])
+            df_unified = df_unified[['SigMun', 'MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc', 'ANO', 'VALOR']]
+
+            # Criação do DataFrame de evolução (índice e ordenação sobre os códigos das categorias)
+            df_evol = self.data.pivot_table(
+                index=['SigMun', 'MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc'], 
+                columns='ANO', 
+                values='VALOR', 
+                fill_value=0,
+                observed=True
+            ).reset_index().rename(columns=str)
         
-        # Criação do DataFrame de evolução
-        df_evol = self.data.pivot_table(
-            index=['SigMun', 'MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc'], 
-            columns='ANO', 
-            values='VALOR', 
-            fill_value=0
-        ).reset_index()
+        # Identificação dinâmica dos anos (inteiros no quadro longo; rótulos de coluna em texto no quadro de evolução)
+        anos_disponiveis = [str(ano) for ano in sorted(df_unified['ANO'].unique())]
 
         # Garantia de que todos os anos estejam presentes no DataFrame de evolução
         for year in anos_disponiveis:
             if year not in df_evol.columns:
                 df_evol[year] = 0
 
-        df_analysis = self.calculate_variations(df_evol, anos_disponiveis)
-        
-        end_time = time.time()
-        logging.info(f"Processamento de dados concluído. Tempo total: {end_time - start_time:.2f} segundos")
-        
-        return df_unified, df_evol, df_analysis
+        return df_unified, df_evol, anos_disponiveis
 
     def calculate_variations(self, df_evol: pd.DataFrame, anos_disponiveis: list) -> Dict[str, pd.DataFrame]:
-        """Calcula as variações percentuais entre anos consecutivos para cada município."""
+        """Calcula as variações percentuais entre anos consecutivos de todos os municípios de uma só vez."""
+        # Todas as variações de anos consecutivos numa única operação sobre a matriz contribuinte × ano
+        valores = df_evol[anos_disponiveis].to_numpy(dtype=float)
+        var_cols = [f'{ano[-2:]}/{proximo[-2:]} %' for ano, proximo in zip(anos_disponiveis[:-1], anos_disponiveis[1:])]
+        variacoes = self._calculate_percentage_change(valores[:, :-1], valores[:, 1:])
+        df_all = pd.concat([df_evol, pd.DataFrame(variacoes, columns=var_cols, index=df_evol.index)], axis=1)
+
+        # Sequência de colunas intercaladas: ano, próximo ano, variação entre eles, ...
+        colunas_intercaladas = ['MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc', anos_disponiveis[0]]
+        for proximo, var_col in zip(anos_disponiveis[1:], var_cols):
+            colunas_intercaladas.extend([proximo, var_col])
+        df_all = df_all[colunas_intercaladas]
+
+        # Separação por município a partir do SigMun que já faz parte do índice do pivot
         analysis_dfs = {}
-        
-        for municipio in df_evol['MUNICIPIO'].unique():
-            df_mun = df_evol[df_evol['MUNICIPIO'] == municipio].copy()
-            df_result = df_mun.copy()
-            
-            # Lista para armazenar a sequência de colunas intercaladas
-            colunas_intercaladas = ['MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc']
-            
-            # Adiciona o primeiro par de anos e a variação entre eles
-            colunas_intercaladas.extend([anos_disponiveis[0], anos_disponiveis[1], f'{anos_disponiveis[0][-2:]}/{anos_disponiveis[1][-2:]} %'])
-            
-            # Calcula a variação para o primeiro par de anos
-            df_result[f'{anos_disponiveis[0][-2:]}/{anos_disponiveis[1][-2:]} %'] = self._calculate_percentage_change(
-                df_result[anos_disponiveis[0]], 
-                df_result[anos_disponiveis[1]]
-            )
-            
-            # Construção dinâmica das colunas intercaladas para anos subsequentes
-            for i in range(1, len(anos_disponiveis) - 1):
-                current_year = anos_disponiveis[i]
-                next_year = anos_disponiveis[i + 1]
-                var_col = f'{current_year[-2:]}/{next_year[-2:]} %'
-                
-                # Adiciona o próximo ano e a variação com o ano anterior
-                colunas_intercaladas.extend([next_year, var_col])
-                
-                # Calcula a variação percentual
-                df_result[var_col] = self._calculate_percentage_change(
-                    df_result[current_year], 
-                    df_result[next_year]
-                )
-            
-            # Reorganiza o DataFrame com colunas intercaladas
-            df_result = df_result[colunas_intercaladas]
-            
-            sig_mun = self.data[self.data['MUNICIPIO'] == municipio]['SigMun'].iloc[0]
+        for sig_mun, linhas in df_evol.groupby('SigMun', sort=False, observed=True).indices.items():
+            df_result = df_all.iloc[linhas]
             analysis_dfs[sig_mun] = df_result
-            
-            logging.info(f"Variações calculadas para {municipio}. Linhas processadas: {len(df_result)}")
-        
+            logging.info(f"Variações calculadas para {df_result['MUNICIPIO'].iloc[0]}. Linhas processadas: {len(df_result)}")
+
         return analysis_dfs
 
     def _calculate_percentage_change(self, series1, series2):
-        """Calcula a variação percentual entre duas séries."""
-        return np.where(series1 != 0,
-                        ((series2 - series1) / series1 * 100).round(2),
-                        np.where(series2 != 0, 100, 0))
\ No newline at end of file
+        """Calcula a variação percentual entre duas séries (ou matrizes de mesma forma)."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(series1 != 0,
+                            ((series2 - series1) / series1 * 100).round(2),
+                            np.where(series2 != 0, 100, 0))
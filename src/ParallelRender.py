@@ -0,0 +1,81 @@
+# ParallelRender.py
+import configparser
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from openpyxl.worksheet.worksheet import Worksheet
+
+STYLE_ATTRIBUTES = ('font', 'fill', 'border', 'alignment', 'number_format', 'protection')
+
+def render_workers(config: configparser.ConfigParser) -> int:
+    """Número de processos para a renderização das abas por município ([PERFORMANCE] RenderWorkers; 0 = número de CPUs)."""
+    workers = config.getint('PERFORMANCE', 'RenderWorkers', fallback=1)
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+def render_in_workers(render: Callable, tasks: Sequence[Tuple], workers: int, output_dir: str) -> List[str]:
+    """Executa render(*tarefa, caminho) em processos separados, cada tarefa gravando um workbook temporário em output_dir.
+
+    Retorna os caminhos dos workbooks na ordem das tarefas, para serem mesclados com merge_sheet.
+    """
+    paths = [os.path.join(output_dir, f"part_{idx:04d}.xlsx") for idx in range(len(tasks))]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        futures = [pool.submit(render, *task, path) for task, path in zip(tasks, paths)]
+        for future in futures:
+            future.result()
+    return paths
+
+class StyleTranslator:
+    def __init__(self, source_workbook, target_workbook):
+        """Converte os estilos das células de um workbook de origem em registros de estilo do workbook de destino."""
+        # Cada combinação de estilo distinta é registrada uma única vez; as demais células reutilizam o StyleArray
+        self.source_workbook = source_workbook
+        self.target_workbook = target_workbook
+        self.translated: Dict[tuple, object] = {}
+
+    def apply(self, source, target) -> None:
+        """Aplica à célula de destino o estilo da célula de origem."""
+        if not source.has_style:
+            return
+        key = tuple(source._style)
+        style = self.translated.get(key)
+        if style is None:
+            style = self._translate(source, target)
+            self.translated[key] = style
+        target._style = copy(style)
+
+    def _translate(self, source, target):
+        """Registra no destino o estilo da célula de origem, herdando do estilo nomeado do destino o que não foi alterado."""
+        name = source.style
+        named = self.source_workbook._named_styles[name]
+        if name in self.target_workbook.named_styles:
+            target.style = name
+        else:
+            named = None
+        for attribute in STYLE_ATTRIBUTES:
+            value = getattr(source, attribute)
+            if named is None or value != getattr(named, attribute):
+                setattr(target, attribute, value if attribute == 'number_format' else copy(value))
+        return copy(target._style)
+
+def merge_sheet(source: Worksheet, target: Worksheet, min_row: int = 1) -> int:
+    """Copia valores, estilos e células mescladas da aba de origem (a partir de min_row) para a mesma posição no destino.
+
+    Retorna o número de linhas copiadas.
+    """
+    translator = StyleTranslator(source.parent, target.parent)
+    rows = 0
+    for row in source.iter_rows(min_row=min_row):
+        for cell in row:
+            if cell.value is None and not cell.has_style:
+                continue
+            target_cell = target.cell(row=cell.row, column=cell.column, value=cell.value)
+            translator.apply(cell, target_cell)
+        rows += 1
+    for merged in source.merged_cells.ranges:
+        if merged.min_row >= min_row:
+            target.merge_cells(merged.coord)
+    logging.debug(f"Aba {source.title} mesclada em {target.title}: {rows} linhas, {len(translator.translated)} estilos")
+    return rows
@@ -0,0 +1,310 @@
+# StreamingWriter.py
+import re
+import warnings
+import zipfile
+from copy import copy
+from typing import Callable, Dict, List, NamedTuple, Optional
+from xml.etree import ElementTree
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.read_only import ReadOnlyCell
+from openpyxl.packaging.relationship import RelationshipList, get_dependents, get_rels_path
+from openpyxl.reader.drawings import find_images
+from openpyxl.reader.workbook import WorkbookParser
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter, range_boundaries
+from openpyxl.worksheet.dimensions import ColumnDimension
+from openpyxl.worksheet.header_footer import HeaderFooter
+from openpyxl.worksheet.page import PageMargins, PrintPageSetup
+from openpyxl.worksheet.print_settings import PrintArea, PrintTitles
+from openpyxl.worksheet.table import Table
+from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.xml.constants import ARC_WORKBOOK, SHEET_MAIN_NS
+from openpyxl.xml.functions import fromstring
+
+# Códigos da função SUBTOTAL usados na linha de totais das tabelas do Excel
+SUBTOTAL_CODES = {'average': 101, 'count': 103, 'countNums': 102, 'max': 104, 'min': 105,
+                  'stdDev': 107, 'sum': 109, 'var': 110}
+SHEET_DATA_START = re.compile(rb'<(?:\w+:)?sheetData\b[^>]*?(/?)>')
+SHEET_DATA_END = re.compile(rb'</(?:\w+:)?sheetData>')
+
+class ColumnStyle(NamedTuple):
+    """Estilo pré-calculado de uma coluna de dados (negative_fill é aplicado apenas a valores negativos)."""
+    font: Font
+    alignment: Alignment
+    number_format: str
+    negative_fill: Optional[PatternFill] = None
+
+class StreamingWorkbookWriter:
+    def __init__(self, template_path: str, header_row: int):
+        """Inicializa o gravador em modo write-only (memória constante) a partir do workbook de modelo."""
+        self.template_path = template_path
+        self.header_row = header_row
+        self.archive = zipfile.ZipFile(template_path)
+        self.template = load_workbook(template_path, read_only=True)
+        self.workbook = Workbook(write_only=True)
+        self.workbook.loaded_theme = self.template.loaded_theme
+        for name, defined_name in self.template.defined_names.items():
+            self.workbook.defined_names[name] = copy(defined_name)
+
+        parser = WorkbookParser(self.archive, ARC_WORKBOOK)
+        parser.parse()
+        self.sheet_paths = {sheet.name: rel.target.lstrip('/') for sheet, rel in parser.find_sheets()}
+        # Nomes locais de cada aba (área e títulos de impressão), indexados pela posição da aba no modelo
+        names = parser.defined_names.by_sheet()
+        self.sheet_names = {title: names.get(idx, {}) for idx, title in enumerate(self.sheet_paths)}
+
+    def close(self) -> None:
+        """Fecha o modelo e o arquivo zip de origem."""
+        self.template.close()
+        self.archive.close()
+
+    def write(self, output_path: str, frames: Dict[str, pd.DataFrame], column_styles: Callable[[List], List[ColumnStyle]],
+              sheets: Optional[Dict[str, Callable[[], Optional[Worksheet]]]] = None) -> Dict[str, int]:
+        """Grava o workbook completo e retorna o número de linhas de dados gravadas por aba.
+
+        sheets associa títulos de aba a funções que geram a aba sob demanda (uma por vez, no momento da gravação);
+        se a função retornar None, a aba do modelo é mantida. Títulos ausentes do modelo são acrescentados ao final.
+        """
+        # Abas presentes em frames: cabeçalho copiado do modelo e dados gravados em fluxo; demais abas: cópia do modelo
+        sheets = sheets or {}
+        written = {}
+        for title in self.template.sheetnames:
+            source = sheets[title]() if title in sheets else None
+            if source is not None:
+                self._copy_worksheet(self.workbook.create_sheet(title), source)
+                continue
+
+            sheet = self.workbook.create_sheet(title)
+            properties = self._read_sheet_properties(title)
+            self._apply_sheet_properties(sheet, properties)
+            self._apply_print_names(sheet, title)
+
+            if title in frames:
+                styles = column_styles(self._copy_rows(sheet, title, max_row=self.header_row))
+                written[title] = self._stream_frame(sheet, frames[title], styles)
+                self._copy_tables(sheet, title, data_rows=written[title], styles=styles)
+            else:
+                self._copy_rows(sheet, title)
+                self._copy_tables(sheet, title)
+                self._copy_drawings(sheet, title)
+                for merged in properties.get('merged', []):
+                    sheet.merged_cells.add(merged)
+
+        for title, render in sheets.items():
+            if title not in self.template.sheetnames:
+                source = render()
+                if source is not None:
+                    self._copy_worksheet(self.workbook.create_sheet(title), source)
+
+        self.workbook.save(output_path)
+        return written
+
+    def _copy_rows(self, sheet, title: str, max_row: Optional[int] = None) -> List:
+        """Copia valores e estilos das linhas do modelo (até max_row) e retorna os valores da última linha copiada."""
+        return self._append_rows(sheet, self.template[title].iter_rows(max_row=max_row))
+
+    def _copy_worksheet(self, sheet, source: Worksheet) -> None:
+        """Copia uma aba gerada em memória (valores, estilos, células mescladas e layout de impressão) para a aba write-only."""
+        for key, dimension in source.column_dimensions.items():
+            if dimension.width:
+                sheet.column_dimensions[key] = ColumnDimension(sheet, index=key, width=dimension.width, customWidth=True)
+        sheet.page_setup = copy(source.page_setup)
+        sheet.page_margins = copy(source.page_margins)
+        sheet.HeaderFooter = copy(source.HeaderFooter)
+        if source.print_title_rows:
+            sheet.print_title_rows = source.print_title_rows
+        if source.print_area:
+            sheet.print_area = [str(cell_range) for cell_range in PrintArea.from_string(source.print_area)]
+        self._append_rows(sheet, source.iter_rows())
+        for merged in source.merged_cells.ranges:
+            sheet.merged_cells.add(merged.coord)
+
+    def _append_rows(self, sheet, rows) -> List:
+        """Acrescenta à aba write-only as linhas de origem com valores e estilos; retorna os valores da última linha."""
+        # Cada combinação de estilo distinta da origem é registrada uma única vez; as demais células reutilizam o StyleArray
+        translated = {}
+        last_values = []
+        for row in rows:
+            cells = []
+            for source in row:
+                cell = WriteOnlyCell(sheet, value=source.value)
+                if getattr(source, 'has_style', False):
+                    key = tuple(source.style_array if isinstance(source, ReadOnlyCell) else source._style)
+                    style = translated.get(key)
+                    if style is None:
+                        cell.font = copy(source.font)
+                        cell.fill = copy(source.fill)
+                        cell.border = copy(source.border)
+                        cell.alignment = copy(source.alignment)
+                        cell.number_format = source.number_format
+                        cell.protection = copy(source.protection)
+                        translated[key] = copy(cell._style)
+                    else:
+                        cell._style = copy(style)
+                cells.append(cell)
+            sheet.append(cells)
+            last_values = [source.value for source in row]
+        return last_values
+
+    def _stream_frame(self, sheet, df: pd.DataFrame, styles: List[ColumnStyle]) -> int:
+        """Grava as linhas do DataFrame em fluxo, reaproveitando os estilos pré-calculados de cada coluna."""
+        prototypes = [self._prototype(sheet, style) for style in styles]
+        negatives = [self._prototype(sheet, style, negative=True) if style.negative_fill else None for style in styles]
+
+        count = 0
+        for values in df.itertuples(index=False, name=None):
+            cells = []
+            for value, prototype, negative in zip(values, prototypes, negatives):
+                cell = WriteOnlyCell(sheet, value=value)
+                if negative is not None and isinstance(value, (int, float)) and value < 0:
+                    cell._style = copy(negative)
+                else:
+                    cell._style = copy(prototype)
+                cells.append(cell)
+            sheet.append(cells)
+            count += 1
+        return count
+
+    def _prototype(self, sheet, style: ColumnStyle, negative: bool = False):
+        """Registra no workbook o estilo de uma coluna e retorna o seu StyleArray."""
+        cell = WriteOnlyCell(sheet)
+        cell.font = style.font
+        cell.alignment = style.alignment
+        cell.number_format = style.number_format
+        if negative:
+            cell.fill = style.negative_fill
+        return cell._style
+
+    def _copy_tables(self, sheet, title: str, data_rows: Optional[int] = None, styles: Optional[List[ColumnStyle]] = None) -> None:
+        """Recria as tabelas do Excel do modelo; nas abas de dados, redimensiona a tabela e grava a linha de totais."""
+        for rel in self._sheet_rels(title).find('http://schemas.openxmlformats.org/officeDocument/2006/relationships/table'):
+            table = Table.from_tree(fromstring(self.archive.read(rel.target.lstrip('/'))))
+            # Os formatos diferenciais (dxf) pertencem ao styles.xml do modelo e não existem no novo workbook
+            table.headerRowDxfId = table.dataDxfId = table.totalsRowDxfId = None
+            for column in table.tableColumns:
+                column.headerRowDxfId = column.dataDxfId = column.totalsRowDxfId = None
+
+            if data_rows is not None:
+                min_col, min_row, max_col, _ = range_boundaries(table.ref)
+                last_data_row = min_row + max(data_rows, 1)
+                if data_rows == 0:
+                    sheet.append([])
+                totals = 1 if table.totalsRowCount else 0
+                if totals:
+                    self._append_totals_row(sheet, table, styles or [])
+                table.ref = f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{last_data_row + totals}"
+                if table.autoFilter is not None:
+                    table.autoFilter.ref = f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{last_data_row}"
+
+            with warnings.catch_warnings():
+                # As colunas vêm do modelo; o aviso do modo write-only sobre colunas manuais não se aplica
+                warnings.simplefilter('ignore')
+                sheet.add_table(table)
+
+    def _append_totals_row(self, sheet, table: Table, styles: List[ColumnStyle]) -> None:
+        """Grava a linha de totais da tabela com fórmulas SUBTOTAL equivalentes às do modelo."""
+        cells = []
+        for idx, column in enumerate(table.tableColumns):
+            value = None
+            if column.totalsRowFunction in SUBTOTAL_CODES:
+                value = f"=SUBTOTAL({SUBTOTAL_CODES[column.totalsRowFunction]},{table.displayName}[{column.name}])"
+            elif column.totalsRowLabel:
+                value = column.totalsRowLabel
+            cell = WriteOnlyCell(sheet, value=value)
+            if idx < len(styles):
+                cell._style = copy(self._prototype(sheet, styles[idx]))
+            cells.append(cell)
+        sheet.append(cells)
+
+    def _copy_drawings(self, sheet, title: str) -> None:
+        """Copia gráficos e imagens do modelo para a aba."""
+        for rel in self._sheet_rels(title).find('http://schemas.openxmlformats.org/officeDocument/2006/relationships/drawing'):
+            charts, images = find_images(self.archive, rel.target.lstrip('/'))
+            for chart in charts:
+                sheet.add_chart(chart, chart.anchor)
+            for image in images:
+                sheet.add_image(image, image.anchor)
+
+    def _sheet_rels(self, title: str) -> RelationshipList:
+        """Retorna os relacionamentos (tabelas, desenhos) da aba no modelo."""
+        rels_path = get_rels_path(self.sheet_paths[title])
+        if rels_path not in self.archive.namelist():
+            return RelationshipList()
+        return get_dependents(self.archive, rels_path)
+
+    def _read_sheet_properties(self, title: str) -> dict:
+        """Lê do XML da aba no modelo as propriedades de layout, sem interpretar o conteúdo de sheetData."""
+        root = ElementTree.fromstring(self._sheet_xml_without_data(self.sheet_paths[title]))
+        ns = {'main': SHEET_MAIN_NS}
+        properties = {'columns': [], 'merged': []}
+        for col in root.iterfind('main:cols/main:col', ns):
+            if col.get('width') is not None:
+                properties['columns'].append((int(col.get('min')), int(col.get('max')), float(col.get('width'))))
+        pane = root.find('main:sheetViews/main:sheetView/main:pane', ns)
+        if pane is not None and pane.get('state') in ('frozen', 'frozenSplit'):
+            column = int(float(pane.get('xSplit', 0))) + 1
+            row = int(float(pane.get('ySplit', 0))) + 1
+            properties['freeze_panes'] = f"{get_column_letter(column)}{row}"
+        for tag, key in (('pageMargins', 'page_margins'), ('pageSetup', 'page_setup'), ('headerFooter', 'header_footer')):
+            element = root.find(f'main:{tag}', ns)
+            if element is not None:
+                properties[key] = element
+        properties['merged'] = [merge.get('ref') for merge in root.iterfind('main:mergeCells/main:mergeCell', ns)]
+        return properties
+
+    def _apply_sheet_properties(self, sheet, properties: dict) -> None:
+        """Aplica à nova aba as larguras de coluna, painéis congelados e configuração de impressão do modelo."""
+        for min_col, max_col, width in properties['columns']:
+            sheet.column_dimensions[get_column_letter(min_col)] = ColumnDimension(
+                sheet, index=get_column_letter(min_col), min=min_col, max=max_col, width=width, customWidth=True)
+        if 'freeze_panes' in properties:
+            sheet.freeze_panes = properties['freeze_panes']
+        if 'page_margins' in properties:
+            sheet.page_margins = PageMargins.from_tree(properties['page_margins'])
+        if 'page_setup' in properties:
+            sheet.page_setup = PrintPageSetup.from_tree(properties['page_setup'])
+        if 'header_footer' in properties:
+            sheet.HeaderFooter = HeaderFooter.from_tree(properties['header_footer'])
+
+    def _apply_print_names(self, sheet, title: str) -> None:
+        """Aplica à nova aba a área e os títulos de impressão definidos para ela no modelo."""
+        for defined_name in self.sheet_names[title].values():
+            if defined_name.is_reserved == 'Print_Titles':
+                titles = PrintTitles.from_string(defined_name.value)
+                if titles.rows is not None:
+                    sheet.print_title_rows = str(titles.rows)
+                if titles.cols is not None:
+                    sheet.print_title_cols = str(titles.cols)
+            elif defined_name.is_reserved == 'Print_Area':
+                sheet.print_area = [str(cell_range) for cell_range in PrintArea.from_string(defined_name.value)]
+
+    def _sheet_xml_without_data(self, path: str, chunk_size: int = 1 << 16) -> bytes:
+        """Lê o XML da aba em blocos descartando o conteúdo de sheetData (memória constante mesmo em abas grandes)."""
+        head, tail = b'', b''
+        with self.archive.open(path) as fh:
+            buffer = b''
+            while True:
+                chunk = fh.read(chunk_size)
+                buffer += chunk
+                match = SHEET_DATA_START.search(buffer)
+                if match or not chunk:
+                    break
+            if not match:
+                return buffer
+            head = buffer[:match.start()]
+            if match.group(1):  # <sheetData/>
+                return head + buffer[match.start():]
+            buffer = buffer[match.end():]
+            while True:
+                end = SHEET_DATA_END.search(buffer)
+                if end:
+                    tail = buffer[end.end():] + fh.read()
+                    break
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    break
+                buffer = buffer[-32:] + chunk  # mantém o suficiente para não partir a tag de fechamento entre blocos
+        return head + b'<sheetData/>' + tail
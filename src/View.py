@@ -1,14 +1,36 @@
 # View.py
 import openpyxl
 from openpyxl.styles import PatternFill, Font, numbers, NamedStyle, Alignment
+from openpyxl.reader.workbook import WorkbookParser
+from openpyxl.utils import get_column_letter, range_boundaries
+from openpyxl.xml.constants import ARC_WORKBOOK
 import pandas as pd
-from typing import Dict
+from typing import Callable, Dict, List, Optional
 import logging
 import time
 import locale
 import configparser
 import json
+import os
+import tempfile
+import zipfile
+from copy import copy
+from functools import partial
 from pathlib import Path
+from src.Fingerprints import SHARD_MANIFEST, SheetFingerprints, frame_fingerprint, load_shard_manifest, save_shard_manifest
+from src.Instrumentation import span
+from src.ParallelRender import merge_sheet, render_in_workers, render_workers
+from src.StreamingWriter import ColumnStyle, StreamingWorkbookWriter
+
+# Colunas com formato GERAL
+GENERAL_FORMAT_COLUMNS = [
+    'SigMun', 
+    'MUNICIPIO', 
+    'CPF_CNPJ', 
+    'RazSoc', 
+    'ANO', 
+    'InscEst'
+]
 
 class ExcelView:
     def __init__(self, config: configparser.ConfigParser, project_root: Path):
@@ -17,8 +39,6 @@ class ExcelView:
         self.config = config
         self.project_root = project_root
         
-        # Configurações de log
-        logging.basicConfig(filename='excel_view.log', level=logging.INFO)
         locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
         
         # Carregamento de configurações de formatação
@@ -27,6 +47,8 @@ class ExcelView:
         self.report_font_size = self.config.getint('FORMATTING', 'font_size_normal')
         self.accounting_format = self.config['FORMATTING']['accounting_format']
         self.text_alignment = self.config['FORMATTING']['text_align_left']
+        self.engine = self.config.get('PERFORMANCE', 'ExcelEngine', fallback='openpyxl')
+        self.output_mode = self.config.get('PERFORMANCE', 'OutputMode', fallback='single')
 
     def setup_accounting_style(self, workbook):
         """Configura o estilo contábil para o workbook."""
@@ -35,86 +57,153 @@ class ExcelView:
             accounting_style.number_format = self.accounting_format
             workbook.add_named_style(accounting_style)
 
-    def _update_sheet(self, sheet, df: pd.DataFrame) -> None:
-        """Atualiza a planilha com os dados do DataFrame, aplicando formatação."""
+    def column_styles(self, header: List) -> List[ColumnStyle]:
+        """Pré-calcula, uma vez por aba, o estilo de cada coluna a partir do nome no cabeçalho."""
         configured_font = Font(name=self.report_font, size=self.report_font_size)
-
-        # Colunas com formato GERAL
-        general_format_columns = [
-            'SigMun', 
-            'MUNICIPIO', 
-            'CPF_CNPJ', 
-            'RazSoc', 
-            'ANO', 
-            'InscEst'
-        ]
+        left_alignment = Alignment(horizontal='left')
+        right_alignment = Alignment(horizontal='right')
 
         # Cor de fundo para valores negativos (vermelho claro)
         light_red_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
 
+        return [ColumnStyle(configured_font, left_alignment, 'General') if column_name in GENERAL_FORMAT_COLUMNS
+                else ColumnStyle(configured_font, right_alignment, self.accounting_format, light_red_fill)
+                for column_name in header]
+
+    def _update_sheet(self, sheet, df: pd.DataFrame) -> None:
+        """Atualiza a planilha com os dados do DataFrame, aplicando formatação, e descarta as linhas da gravação anterior que sobraram."""
+        totals = self._table_totals(sheet)
+        # Determina o tipo de cada coluna pelo cabeçalho, uma única vez
+        header = [sheet.cell(row=self.start_row - 1, column=c_idx).value for c_idx in range(1, len(df.columns) + 1)]
+        styles = self.column_styles(header)
+
         # Aplicação de formatação por coluna
         for r_idx, row in enumerate(df.itertuples(index=False), start=self.start_row):
-            for c_idx, value in enumerate(row, start=1):
+            for c_idx, (value, style) in enumerate(zip(row, styles), start=1):
                 cell = sheet.cell(row=r_idx, column=c_idx)
                 cell.value = value
-                cell.font = configured_font
-
-                # Determina o tipo de coluna para formatação
-                header_cell = sheet.cell(row=self.start_row - 1, column=c_idx)
-                column_name = header_cell.value
-
-                # Formatação para colunas de texto (Formato GERAL)
-                if column_name in general_format_columns:
-                    cell.number_format = 'General'
-                    cell.alignment = Alignment(horizontal='left')
-                
-                # Formatação para colunas numéricas
-                else:
-                    cell.number_format = self.accounting_format
-                    cell.alignment = Alignment(horizontal='right')
-                    
-                    # Aplica preenchimento vermelho claro para valores negativos
-                    if isinstance(value, (int, float)) and value < 0:
-                        cell.fill = light_red_fill
+                cell.font = style.font
+                cell.number_format = style.number_format
+                cell.alignment = style.alignment
+
+                # Aplica preenchimento vermelho claro para valores negativos
+                if style.negative_fill is not None and isinstance(value, (int, float)) and value < 0:
+                    cell.fill = style.negative_fill
+
+        self._fit_sheet(sheet, len(df), totals)
 
     def update_tab_unificada(self, df: pd.DataFrame) -> None:
         """Atualiza a aba TAB_Unificada."""
         sheet = self.workbook['TAB_Unificada']
         df = df[['SigMun', 'MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc', 'ANO', 'VALOR']]
-        self._update_sheet(sheet, df)
+        with span('sheet', rows=len(df), sheet=sheet.title):
+            self._update_sheet(sheet, df)
         logging.info(f"Aba TAB_Unificada atualizada. Linhas processadas: {len(df)}")
 
     def update_tab_evolrazsoc(self, df: pd.DataFrame) -> None:
         """Atualiza a aba TAB_EvolRazSoc."""
         sheet = self.workbook['TAB_EvolRazSoc']
-        self._update_sheet(sheet, df)
+        with span('sheet', rows=len(df), sheet=sheet.title):
+            self._update_sheet(sheet, df)
         logging.info(f"Aba TAB_EvolRazSoc atualizada. Linhas processadas: {len(df)}")
 
     def update_analysis_tabs(self, df_analysis: Dict[str, pd.DataFrame]) -> None:
         """Atualiza as abas de análise para cada município."""
+        workers = render_workers(self.config)
+        if workers > 1 and len(df_analysis) > 1:
+            self.update_analysis_tabs_parallel(df_analysis, workers)
+            return
+
         for sig_mun, df in df_analysis.items():
             sheet_name = f"Variacao{sig_mun}"
             if sheet_name in self.workbook.sheetnames:
                 sheet = self.workbook[sheet_name]
-                self._update_sheet(sheet, df)
+                with span('sheet', rows=len(df), sheet=sheet_name, sig_mun=sig_mun):
+                    self._update_sheet(sheet, df)
                 logging.info(f"Aba {sheet_name} atualizada. Linhas processadas: {len(df)}")
             else:
                 logging.warning(f"Aba {sheet_name} não encontrada no arquivo Excel.")
 
-    def update_excel(self, file_path: str, df_unified: pd.DataFrame, df_evol: pd.DataFrame, df_analysis: Dict[str, pd.DataFrame]) -> None:
-        """Método principal para atualizar o arquivo Excel."""
+    def update_analysis_tabs_parallel(self, df_analysis: Dict[str, pd.DataFrame], workers: int) -> None:
+        """Renderiza as abas Variacao em processos separados (um workbook temporário por município) e as mescla no workbook."""
+        sheets = {}
+        for sig_mun in df_analysis:
+            sheet_name = f"Variacao{sig_mun}"
+            if sheet_name in self.workbook.sheetnames:
+                sheets[sig_mun] = self.workbook[sheet_name]
+            else:
+                logging.warning(f"Aba {sheet_name} não encontrada no arquivo Excel.")
+
+        tasks = []
+        for sig_mun, sheet in sheets.items():
+            header = [sheet.cell(row=self.start_row - 1, column=c_idx).value for c_idx in range(1, len(df_analysis[sig_mun].columns) + 1)]
+            tasks.append((self.config, self.project_root, header, df_analysis[sig_mun]))
+
+        with tempfile.TemporaryDirectory(prefix='variacao_') as output_dir:
+            with span('render_workers', rows=sum(len(df_analysis[sig_mun]) for sig_mun in sheets), workers=workers):
+                paths = render_in_workers(render_sheet_rows, tasks, workers, output_dir)
+            for (sig_mun, sheet), path in zip(sheets.items(), paths):
+                with span('merge_sheet', rows=len(df_analysis[sig_mun]), sheet=sheet.title, sig_mun=sig_mun):
+                    totals = self._table_totals(sheet)
+                    rendered = openpyxl.load_workbook(path)
+                    merge_sheet(rendered.active, sheet, min_row=self.start_row)
+                    rendered.close()
+                    self._fit_sheet(sheet, len(df_analysis[sig_mun]), totals)
+                logging.info(f"Aba {sheet.title} atualizada. Linhas processadas: {len(df_analysis[sig_mun])}")
+
+    def open_sheet_fingerprints(self, file_path: str) -> Optional[SheetFingerprints]:
+        """Abre as impressões digitais das abas do workbook, se [PERFORMANCE] SkipUnchangedSheets."""
+        if not self.config.getboolean('PERFORMANCE', 'SkipUnchangedSheets', fallback=False):
+            return None
+        return SheetFingerprints(file_path)
+
+    def variacao_fingerprint(self, df: pd.DataFrame) -> str:
+        """Impressão digital dos dados e da formatação de uma aba Variacao."""
+        return frame_fingerprint(df, salt=json.dumps(dict(self.config['FORMATTING']), sort_keys=True))
+
+    def changed_analysis_tabs(self, df_analysis: Dict[str, pd.DataFrame], fingerprints: Optional[SheetFingerprints],
+                              sheetnames: List[str]) -> Dict[str, pd.DataFrame]:
+        """Seleciona as abas Variacao cujos dados ou formatação mudaram desde a última gravação; as demais ficam intactas."""
+        if fingerprints is None:
+            return df_analysis
+        changed = {}
+        for sig_mun, df in df_analysis.items():
+            if fingerprints.changed(f"Variacao{sig_mun}", self.variacao_fingerprint(df), sheetnames):
+                changed[sig_mun] = df
+            else:
+                logging.info(f"Aba Variacao{sig_mun} inalterada, mantida.")
+        return changed
+
+    def update_excel(self, file_path: str, df_unified: pd.DataFrame, df_evol: pd.DataFrame, df_analysis: Dict[str, pd.DataFrame],
+                     analyzer: Optional[Callable] = None) -> None:
+        """Método principal para atualizar o arquivo Excel; analyzer, se informado, grava abas adicionais antes de salvar."""
+        if self.output_mode == 'sharded':
+            self.update_excel_sharded(file_path, df_unified, df_evol, df_analysis, analyzer)
+            return
+        if self.engine == 'streaming':
+            self.update_excel_streaming(file_path, df_unified, df_evol, df_analysis, analyzer)
+            return
+
         start_time = time.time()
         try:
-            self.workbook = openpyxl.load_workbook(file_path)
+            with span('excel_load'):
+                self.workbook = openpyxl.load_workbook(file_path)
             
             # Configura o estilo contábil
             self.setup_accounting_style(self.workbook)
             
             self.update_tab_unificada(df_unified)
             self.update_tab_evolrazsoc(df_evol)
-            self.update_analysis_tabs(df_analysis)
+            fingerprints = self.open_sheet_fingerprints(file_path)
+            self.update_analysis_tabs(self.changed_analysis_tabs(df_analysis, fingerprints, self.workbook.sheetnames))
+            if analyzer is not None:
+                with span('analysis', rows=len(df_evol)):
+                    analyzer(df_evol, self.workbook, fingerprints)
             
-            self.workbook.save(file_path)
+            with span('excel_save'):
+                self.workbook.save(file_path)
+            if fingerprints is not None:
+                fingerprints.save()
             end_time = time.time()
             logging.info(f"Arquivo Excel atualizado: {file_path}. Tempo total: {end_time - start_time:.2f} segundos")
         except Exception as e:
@@ -124,4 +213,278 @@ class ExcelView:
             # Garantir que o workbook seja fechado mesmo se ocorrer um erro
             if hasattr(self, 'workbook') and self.workbook is not None:
                 self.workbook.close()
-                del self.workbook
\ No newline at end of file
+                del self.workbook
+
+    def update_municipality(self, file_path: str, sig_mun: str, df_variacao: pd.DataFrame, df_evol: pd.DataFrame,
+                            analyzer: Callable, analysis_fingerprints: Optional[Dict[str, str]] = None) -> None:
+        """Regrava apenas as abas Variacao/Analise de um município no arquivo existente (consulta --mun), sem tocar nas demais.
+
+        analysis_fingerprints: impressões digitais das abas Analise que o analyzer gravaria; se elas e a da aba Variacao
+        coincidem com as registradas, o arquivo nem é aberto.
+        """
+        if self.output_mode == 'sharded':
+            file_path = os.path.join(os.path.dirname(file_path), f"Tabula_{sig_mun}.xlsx")
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Arquivo Excel não encontrado para a consulta de {sig_mun}: {file_path} (execute antes o processamento completo)")
+
+        start_time = time.time()
+        tmp_path = f"{file_path}.tmp"
+        fingerprints = self.open_sheet_fingerprints(file_path)
+        if fingerprints is not None and analysis_fingerprints is not None:
+            expected = {f"Variacao{sig_mun}": self.variacao_fingerprint(df_variacao), **analysis_fingerprints}
+            sheetnames = workbook_sheet_names(file_path)
+            if all(fingerprints.unchanged(sheet_name, fingerprint, sheetnames) for sheet_name, fingerprint in expected.items()):
+                logging.info(f"Abas do município {sig_mun} inalteradas: {file_path} mantido.")
+                return
+        with span('excel_load'):
+            self.workbook = openpyxl.load_workbook(file_path)
+        try:
+            self.setup_accounting_style(self.workbook)
+            self.update_analysis_tabs(self.changed_analysis_tabs({sig_mun: df_variacao}, fingerprints, self.workbook.sheetnames))
+            with span('analysis', rows=len(df_evol)):
+                analyzer(df_evol, self.workbook, fingerprints)
+
+            with span('excel_save'):
+                self.workbook.save(tmp_path)
+        except Exception as e:
+            logging.error(f"Erro ao atualizar o arquivo Excel: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            self.workbook.close()
+            self.workbook = None
+        os.replace(tmp_path, file_path)
+        if fingerprints is not None:
+            fingerprints.save()
+        end_time = time.time()
+        logging.info(f"Abas do município {sig_mun} atualizadas em {file_path}. Tempo total: {end_time - start_time:.2f} segundos")
+
+    def update_excel_streaming(self, file_path: str, df_unified: pd.DataFrame, df_evol: pd.DataFrame, df_analysis: Dict[str, pd.DataFrame],
+                               analyzer: Optional[Callable] = None) -> None:
+        """Regrava o arquivo Excel em modo write-only, com memória constante independentemente do número de linhas."""
+        start_time = time.time()
+        frames = {
+            'TAB_Unificada': df_unified[['SigMun', 'MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc', 'ANO', 'VALOR']],
+            'TAB_EvolRazSoc': df_evol
+        }
+
+        # O arquivo atual serve de modelo (títulos, cabeçalhos, tabelas e gráficos) e é substituído ao final;
+        # abas Variacao inalteradas não entram em frames e são copiadas do modelo como estão
+        tmp_path = f"{file_path}.tmp"
+        fingerprints = self.open_sheet_fingerprints(file_path)
+        writer = StreamingWorkbookWriter(file_path, self.start_row - 1)
+        try:
+            changed = self.changed_analysis_tabs(df_analysis, fingerprints, writer.template.sheetnames)
+            frames.update({f"Variacao{sig_mun}": df for sig_mun, df in changed.items()})
+            for sheet_name in frames:
+                if sheet_name not in writer.template.sheetnames:
+                    logging.warning(f"Aba {sheet_name} não encontrada no arquivo Excel.")
+            sheets = {}
+            if analyzer is not None:
+                sheets = self.analysis_sheets(analyzer, df_evol, fingerprints, writer.template)
+            with span('excel_stream', rows=sum(len(df) for df in frames.values())):
+                written = writer.write(tmp_path, frames, self.column_styles, sheets)
+        except Exception as e:
+            logging.error(f"Erro ao atualizar o arquivo Excel: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            writer.close()
+        os.replace(tmp_path, file_path)
+        if fingerprints is not None:
+            fingerprints.save()
+
+        for sheet_name, rows in written.items():
+            logging.info(f"Aba {sheet_name} atualizada. Linhas processadas: {rows}")
+        end_time = time.time()
+        logging.info(f"Arquivo Excel atualizado (streaming): {file_path}. Tempo total: {end_time - start_time:.2f} segundos")
+
+    def analysis_sheets(self, analyzer: Callable, df_evol: pd.DataFrame, fingerprints: Optional[SheetFingerprints],
+                        template) -> Dict[str, Callable]:
+        """Prepara as abas Analise para o gravador em fluxo: cada município é analisado sob demanda, um por vez."""
+        sheets = {}
+        for sig_mun, rows in df_evol.groupby('SigMun', sort=False, observed=True).indices.items():
+            sheet_name = f"Analise{sig_mun}"
+            sheets[sheet_name] = partial(self._render_analysis_sheet, analyzer, df_evol.iloc[rows], sheet_name,
+                                         fingerprints, template)
+        return sheets
+
+    def _render_analysis_sheet(self, analyzer: Callable, df: pd.DataFrame, sheet_name: str,
+                               fingerprints: Optional[SheetFingerprints], template):
+        """Gera a aba Analise de um município num workbook próprio; retorna None se a aba existente está atualizada."""
+        workbook = openpyxl.Workbook()
+        workbook.remove(workbook.active)
+        # Os estilos nomeados do modelo (contábil, percentual) prevalecem sobre os do analyzer, como no workbook completo
+        for style in template._named_styles:
+            if style.name not in workbook.named_styles:
+                workbook.add_named_style(NamedStyle(name=style.name, font=copy(style.font), fill=copy(style.fill),
+                                                    border=copy(style.border), alignment=copy(style.alignment),
+                                                    number_format=style.number_format, protection=copy(style.protection)))
+        # Aba provisória com o nome da existente: o analyzer a substitui, ou a mantém se a impressão digital não mudou
+        placeholder = workbook.create_sheet(sheet_name) if sheet_name in template.sheetnames else None
+        with span('analysis', rows=len(df)):
+            analyzer(df, workbook, fingerprints)
+        sheet = workbook[sheet_name] if sheet_name in workbook.sheetnames else None
+        return None if sheet is placeholder else sheet
+
+    def update_excel_sharded(self, file_path: str, df_unified: pd.DataFrame, df_evol: pd.DataFrame, df_analysis: Dict[str, pd.DataFrame],
+                             analyzer: Optional[Callable] = None) -> None:
+        """Grava um workbook Tabula_<SigMun>.xlsx por município, regenerando apenas os shards cujos dados mudaram, e o resumo."""
+        start_time = time.time()
+        output_dir = os.path.dirname(file_path)
+        manifest_path = os.path.join(output_dir, SHARD_MANIFEST)
+        fingerprints = load_shard_manifest(manifest_path)
+        # Mudanças de configuração (formatos, limites da análise) também invalidam os shards
+        salt = json.dumps({section: dict(self.config[section]) for section in self.config.sections()}, sort_keys=True)
+
+        unified_by_mun = dict(tuple(df_unified.groupby('SigMun', sort=False, observed=True)))
+        evol_by_mun = dict(tuple(df_evol.groupby('SigMun', sort=False, observed=True)))
+        shard_files = {}
+        for sig_mun, df_variacao in df_analysis.items():
+            shard_path = os.path.join(output_dir, f"Tabula_{sig_mun}.xlsx")
+            shard_files[sig_mun] = os.path.basename(shard_path)
+            shard_unified, shard_evol = unified_by_mun[sig_mun], evol_by_mun[sig_mun]
+            fingerprint = frame_fingerprint(shard_unified, shard_evol, df_variacao, salt=salt)
+            if fingerprints.get(sig_mun) == fingerprint and os.path.exists(shard_path):
+                logging.info(f"Shard {shard_files[sig_mun]} inalterado, mantido.")
+                continue
+
+            # Shards já existentes servem de modelo para si mesmos; os novos partem do arquivo completo
+            template_path = shard_path if os.path.exists(shard_path) else file_path
+            with span('shard', rows=len(shard_unified), sig_mun=sig_mun):
+                self.update_shard(template_path, shard_path, sig_mun, shard_unified, shard_evol, df_variacao, analyzer)
+            fingerprints[sig_mun] = fingerprint
+            save_shard_manifest(manifest_path, fingerprints)
+
+        summary_path = os.path.join(output_dir, self.config.get('PERFORMANCE', 'SummaryFileName', fallback='Tabula_Resumo.xlsx'))
+        self.write_summary(summary_path, df_evol, shard_files)
+        end_time = time.time()
+        logging.info(f"Shards atualizados em {output_dir}. Tempo total: {end_time - start_time:.2f} segundos")
+
+    def update_shard(self, template_path: str, shard_path: str, sig_mun: str, df_unified: pd.DataFrame, df_evol: pd.DataFrame,
+                     df_variacao: pd.DataFrame, analyzer: Optional[Callable] = None) -> None:
+        """Grava o workbook de um município a partir do modelo, mantendo apenas as abas Variacao/Analise do próprio município."""
+        own_sheets = (f"Variacao{sig_mun}", f"Analise{sig_mun}")
+        tmp_path = f"{shard_path}.tmp"
+        self.workbook = openpyxl.load_workbook(template_path)
+        try:
+            for sheet_name in list(self.workbook.sheetnames):
+                if sheet_name.startswith(('Variacao', 'Analise')) and sheet_name not in own_sheets:
+                    del self.workbook[sheet_name]
+            self.setup_accounting_style(self.workbook)
+
+            # O modelo pode ter mais linhas que o shard (ex.: o arquivo completo): _update_sheet ajusta tabelas e linhas aos dados
+            self.update_tab_unificada(df_unified)
+            self.update_tab_evolrazsoc(df_evol)
+            self.update_analysis_tabs({sig_mun: df_variacao})
+            if analyzer is not None:
+                with span('analysis', rows=len(df_evol)):
+                    analyzer(df_evol, self.workbook)
+
+            self.workbook.save(tmp_path)
+        except Exception as e:
+            logging.error(f"Erro ao gravar o shard {shard_path}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            self.workbook.close()
+            self.workbook = None
+        os.replace(tmp_path, shard_path)
+        logging.info(f"Shard gravado: {shard_path}")
+
+    def _table_totals(self, sheet) -> Dict[str, List]:
+        """Guarda valor e estilo da linha de totais de cada tabela da aba, antes que os dados a sobrescrevam."""
+        snapshot = {}
+        for table in sheet.tables.values():
+            if table.totalsRowCount:
+                min_col, _, max_col, max_row = range_boundaries(table.ref)
+                cells = [sheet.cell(row=max_row, column=c_idx) for c_idx in range(min_col, max_col + 1)]
+                snapshot[table.name] = [(cell.value, copy(cell._style)) for cell in cells]
+        return snapshot
+
+    def _truncate_rows(self, sheet, last_row: int) -> int:
+        """Descarta de uma só vez tudo o que estiver abaixo de last_row, encolhendo a dimensão gravada da aba; retorna as linhas removidas."""
+        max_row = sheet.max_row
+        if max_row <= last_row:
+            return 0
+        # Linhas finais não deslocam nenhuma outra: em vez de delete_rows (que ordena todas as chaves e remove
+        # célula a célula), o armazenamento de células é filtrado em uma passada, junto com as alturas de linha e as mesclagens
+        sheet._cells = {key: cell for key, cell in sheet._cells.items() if key[0] <= last_row}
+        for row in [row for row in sheet.row_dimensions if row > last_row]:
+            del sheet.row_dimensions[row]
+        for merged in [merged for merged in sheet.merged_cells.ranges if merged.min_row > last_row]:
+            sheet.merged_cells.remove(merged)
+        return max_row - last_row
+
+    def _fit_sheet(self, sheet, data_rows: int, totals: Dict[str, List]) -> None:
+        """Remove as linhas excedentes (dados antigos e a linha de totais anterior) e ajusta o intervalo e a linha de totais das tabelas."""
+        last_data_row = self.start_row + max(data_rows, 1) - 1
+        removed = self._truncate_rows(sheet, last_data_row)
+        if removed:
+            logging.debug(f"Aba {sheet.title}: {removed} linhas excedentes descartadas")
+        if data_rows == 0:
+            # A tabela mantém uma linha de dados (vazia, com a formatação) para continuar válida
+            for cell in sheet[self.start_row]:
+                cell.value = None
+
+        for table in sheet.tables.values():
+            min_col, min_row, max_col, _ = range_boundaries(table.ref)
+            totals_row = totals.get(table.name)
+            if totals_row:
+                for c_idx, (value, style) in enumerate(totals_row, start=min_col):
+                    cell = sheet.cell(row=last_data_row + 1, column=c_idx, value=value)
+                    cell._style = copy(style)
+            table.ref = f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{last_data_row + (1 if totals_row else 0)}"
+            if table.autoFilter is not None:
+                table.autoFilter.ref = f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{last_data_row}"
+
+    def write_summary(self, summary_path: str, df_evol: pd.DataFrame, shard_files: Dict[str, str]) -> None:
+        """Grava o workbook de resumo com o total de contribuintes e o valor total por ano de cada município."""
+        years = [column for column in df_evol.columns if str(column).isdigit()]
+        grouped = df_evol.groupby(['SigMun', 'MUNICIPIO'], sort=False, observed=True)
+        summary = grouped[years].sum()
+        summary.insert(0, 'Contribuintes', grouped.size())
+        summary = summary.reset_index()
+        summary['Arquivo'] = summary['SigMun'].astype(str).map(shard_files)
+
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.title = 'Resumo'
+        header_font = Font(name=self.report_font, size=self.report_font_size, bold=True)
+        for c_idx, column_name in enumerate(summary.columns, start=1):
+            cell = sheet.cell(row=1, column=c_idx, value=str(column_name))
+            cell.font = header_font
+
+        general = ColumnStyle(Font(name=self.report_font, size=self.report_font_size), Alignment(horizontal='left'), 'General')
+        styles = [style if column_name in years else general
+                  for column_name, style in zip(summary.columns, self.column_styles(list(summary.columns)))]
+        for r_idx, row in enumerate(summary.itertuples(index=False), start=2):
+            for c_idx, (value, style) in enumerate(zip(row, styles), start=1):
+                cell = sheet.cell(row=r_idx, column=c_idx, value=value)
+                cell.font = style.font
+                cell.number_format = style.number_format
+                cell.alignment = style.alignment
+        sheet.freeze_panes = 'A2'
+
+        workbook.save(summary_path)
+        logging.info(f"Resumo por município gravado: {summary_path}")
+
+def workbook_sheet_names(file_path: str) -> List[str]:
+    """Nomes das abas do workbook, lidos apenas do workbook.xml (sem carregar as abas)."""
+    with zipfile.ZipFile(file_path) as archive:
+        parser = WorkbookParser(archive, ARC_WORKBOOK)
+        parser.parse()
+        return [sheet.name for sheet in parser.sheets]
+
+def render_sheet_rows(config: configparser.ConfigParser, project_root: Path, header: List, df: pd.DataFrame, output_path: str) -> None:
+    """Grava as linhas de dados de uma aba em um workbook temporário (executado em um processo de renderização)."""
+    view = ExcelView(config, project_root)
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for c_idx, column_name in enumerate(header, start=1):
+        sheet.cell(row=view.start_row - 1, column=c_idx, value=column_name)
+    view._update_sheet(sheet, df)
+    workbook.save(output_path)
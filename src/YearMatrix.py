@@ -0,0 +1,201 @@
+# YearMatrix.py
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Chave do contribuinte na matriz: inscrição estadual no município (o valor adicionado é apurado por município);
+# os demais campos de identificação são atributos, resolvidos pela mesma política dos valores
+KEY_COLUMNS = ['SigMun', 'InscEst']
+ATTRIBUTE_COLUMNS = ['MUNICIPIO', 'CPF_CNPJ', 'RazSoc']
+# Atributos cujas divergências entre janelas entram no relatório de conciliação
+REPORTED_ATTRIBUTES = ['CPF_CNPJ', 'RazSoc']
+# Política para o mesmo contribuinte/ano informado por mais de uma janela de 3 anos (as janelas se sobrepõem)
+DUPLICATE_POLICIES = ('first', 'latest', 'max')
+# Faixa das inscrições estaduais (8 dígitos) na chave inteira; inscrições fora dela colidiriam com as de outro município
+INSC_EST_SPAN = 10**8
+REPORT_COLUMNS = ['SigMun', 'InscEst', 'ANO', 'Campo', 'Janelas', 'Valores', 'Adotado']
+
+class TaxpayerYearMatrix:
+    def __init__(self, policy: str = 'first'):
+        """Inicializa a matriz densa contribuinte × ano alimentada diretamente pelos quadros largos de cada arquivo."""
+        # 'first': vale a janela mais antiga que informou a célula; 'latest': vale a janela mais recente;
+        # 'max': vale o maior valor informado (atributos da janela mais recente). As janelas são ordenadas pelo
+        # último ano de cada arquivo, e não pela ordem de carga; empates seguem a ordem de carga
+        if policy not in DUPLICATE_POLICIES:
+            raise ValueError(f"Política de duplicatas inválida: {policy} (use {', '.join(DUPLICATE_POLICIES)})")
+        self.policy = policy
+        self.key_index: Optional[pd.Index] = None
+        self.sig_codes: Dict[str, int] = {}
+        self.window_ends: List[int] = []
+        self.window_labels: List[str] = []
+        self._attribute_rows: List[np.ndarray] = []
+        self._attribute_frames: List[pd.DataFrame] = []
+        self._cells: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._built = None
+        self.report: pd.DataFrame = pd.DataFrame(columns=REPORT_COLUMNS)
+
+    def __len__(self) -> int:
+        """Número de contribuintes distintos registrados."""
+        return 0 if self.key_index is None else len(self.key_index)
+
+    def add(self, frame: pd.DataFrame) -> None:
+        """Registra os valores anuais de um arquivo (quadro largo: chave, atributos e uma coluna por ano)."""
+        years = [column for column in frame.columns if str(column).isdigit()]
+        insc_est = frame['InscEst'].to_numpy(dtype=np.int64)
+        out_of_range = (insc_est < 0) | (insc_est >= INSC_EST_SPAN)
+        if out_of_range.any():
+            logging.warning(f"Linhas com inscrição estadual fora da faixa [0, {INSC_EST_SPAN}) descartadas: {int(out_of_range.sum())} "
+                            f"(ex.: {insc_est[out_of_range][:5].tolist()})")
+            frame = frame[~out_of_range]
+            insc_est = insc_est[~out_of_range]
+
+        # Chave inteira (código do SigMun × 10^8 + inscrição) consultada em um índice hash de int64
+        sig_mun = frame['SigMun'].astype(str)
+        for sig in sig_mun.unique():
+            self.sig_codes.setdefault(sig, len(self.sig_codes))
+        keys = pd.Index(sig_mun.map(self.sig_codes).to_numpy(dtype=np.int64) * INSC_EST_SPAN + insc_est)
+
+        positions = self.key_index.get_indexer(keys) if self.key_index is not None else np.full(len(keys), -1)
+        new = positions < 0
+        if new.any():
+            new_keys = keys[new].unique()
+            self.key_index = new_keys if self.key_index is None else self.key_index.append(new_keys)
+            positions[new] = self.key_index.get_indexer(keys[new])
+
+        window = len(self.window_ends)
+        self.window_ends.append(max(int(year) for year in years))
+        self.window_labels.append(f"{min(years)}a{max(years)}")
+        self._attribute_rows.append(positions)
+        self._attribute_frames.append(frame[KEY_COLUMNS + ATTRIBUTE_COLUMNS].assign(_window=window))
+        # Ordem de chegada das células: linha a linha do arquivo, ano a ano dentro da linha
+        values = frame[years].to_numpy(dtype=float)
+        self._cells.append((np.repeat(positions, len(years)),
+                            np.tile(np.array([int(year) for year in years]), len(positions)),
+                            values.ravel()))
+        self._built = None
+
+    def _reconcile(self, ids: np.ndarray, windows: np.ndarray, values: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Ordena as ocorrências por id e janela em uma única passada e aplica a política.
+
+        Retorna a ordenação e, para cada id distinto (em ordem crescente), a posição na ordenação da ocorrência que prevalece.
+        """
+        window_ends = np.asarray(self.window_ends)[windows]
+        # lexsort: a última chave é a principal; a ordem de chegada desempata
+        sort_keys = [np.arange(len(ids)), window_ends]
+        if self.policy == 'max' and values is not None:
+            sort_keys.append(values)
+        order = np.lexsort(sort_keys + [ids])
+        sorted_ids = ids[order]
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        if self.policy == 'first':
+            return order, starts
+        return order, np.r_[starts[1:], len(ids)] - 1
+
+    def build(self) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray, np.ndarray]:
+        """Materializa a matriz: contribuintes (SigMun, InscEst) na ordem da primeira ocorrência, anos, valores e máscara das células informadas."""
+        if self._built is not None:
+            return self._built
+
+        rows = np.concatenate([cell[0] for cell in self._cells])
+        year_labels = np.concatenate([cell[1] for cell in self._cells])
+        cell_values = np.concatenate([cell[2] for cell in self._cells])
+        cell_windows = np.repeat(np.arange(len(self._cells)), [len(cell[0]) for cell in self._cells])
+        years = np.unique(year_labels)
+
+        # Células repetidas entre janelas são resolvidas de uma vez, pela posição da ocorrência vencedora
+        cell_ids = rows * len(years) + np.searchsorted(years, year_labels)
+        order, winners = self._reconcile(cell_ids, cell_windows, cell_values)
+        matrix = np.zeros((len(self), len(years)))
+        filled = np.zeros((len(self), len(years)), dtype=bool)
+        matrix.flat[cell_ids[order[winners]]] = cell_values[order[winners]]
+        filled.flat[cell_ids[order[winners]]] = True
+
+        attributes = pd.concat(self._attribute_frames, ignore_index=True)
+        attributes['_row'] = np.concatenate(self._attribute_rows)
+        attribute_order, attribute_winners = self._reconcile(attributes['_row'].to_numpy(), attributes['_window'].to_numpy())
+        attributes = attributes.iloc[attribute_order].reset_index(drop=True)
+        # Categorias diferentes entre arquivos viram texto na concatenação: recategoriza com as categorias ordenadas
+        taxpayers = attributes.iloc[attribute_winners][['SigMun', 'MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc']].astype(
+            {column: 'category' for column in ['SigMun'] + ATTRIBUTE_COLUMNS}).reset_index(drop=True)
+
+        self.report = pd.concat([
+            self._value_report(taxpayers, years, cell_ids[order], cell_windows[order], cell_values[order], winners),
+            *(self._attribute_report(taxpayers, attributes, column) for column in REPORTED_ATTRIBUTES)
+        ], ignore_index=True)
+        logging.info(f"Matriz contribuinte × ano: {len(self)} contribuintes, {len(years)} anos, "
+                     f"{len(cell_ids) - len(winners)} células repetidas resolvidas pela política '{self.policy}', "
+                     f"{len(self.report)} divergências entre janelas")
+        self._built = (taxpayers, years, matrix, filled)
+        return self._built
+
+    def _value_report(self, taxpayers: pd.DataFrame, years: np.ndarray, ids: np.ndarray, windows: np.ndarray,
+                      values: np.ndarray, winners: np.ndarray) -> pd.DataFrame:
+        """Células informadas com valores diferentes por mais de uma janela (entradas já ordenadas por célula)."""
+        starts = np.r_[0, np.flatnonzero(np.diff(ids)) + 1]
+        counts = np.diff(np.r_[starts, len(ids)])
+        divergent = np.maximum.reduceat(values, starts) > np.minimum.reduceat(values, starts)
+        if not divergent.any():
+            return pd.DataFrame(columns=REPORT_COLUMNS)
+
+        # Apenas as ocorrências dos grupos divergentes (poucas) são convertidas em texto
+        members = np.repeat(divergent, counts)
+        texts = pd.Series(np.asarray(self.window_labels, dtype=object)[windows[members]]
+                          + ': ' + np.char.mod('%.2f', values[members]).astype(object))
+        group = np.repeat(np.arange(len(starts)), counts)[members]
+        row_idx, year_idx = np.divmod(ids[starts[divergent]], len(years))
+        return pd.DataFrame({
+            'SigMun': taxpayers['SigMun'].to_numpy()[row_idx].astype(str),
+            'InscEst': taxpayers['InscEst'].to_numpy()[row_idx],
+            'ANO': years[year_idx],
+            'Campo': 'VALOR',
+            'Janelas': counts[divergent],
+            'Valores': texts.groupby(group, sort=True).agg(' | '.join).to_numpy(),
+            'Adotado': np.char.mod('%.2f', values[winners[divergent]])
+        })
+
+    def _attribute_report(self, taxpayers: pd.DataFrame, attributes: pd.DataFrame, column: str) -> pd.DataFrame:
+        """Contribuintes com mais de um conteúdo para o atributo entre janelas (ex.: mudança de razão social)."""
+        texts = attributes[column].astype(str)
+        distinct = pd.DataFrame({'_row': attributes['_row'], 'text': texts}).drop_duplicates()
+        changed = distinct.loc[distinct['_row'].duplicated(), '_row'].unique()
+        if not len(changed):
+            return pd.DataFrame(columns=REPORT_COLUMNS)
+
+        members = attributes['_row'].isin(changed).to_numpy()
+        labels = np.asarray(self.window_labels, dtype=object)[attributes['_window'].to_numpy()[members]]
+        grouped = pd.Series(labels + ': ' + texts[members].to_numpy()).groupby(attributes['_row'].to_numpy()[members], sort=True)
+        rows = np.sort(changed)
+        return pd.DataFrame({
+            'SigMun': taxpayers['SigMun'].to_numpy()[rows].astype(str),
+            'InscEst': taxpayers['InscEst'].to_numpy()[rows],
+            'ANO': None,
+            'Campo': column,
+            'Janelas': grouped.size().to_numpy(),
+            'Valores': grouped.agg(' | '.join).to_numpy(),
+            'Adotado': taxpayers[column].astype(str).to_numpy()[rows]
+        })
+
+    def tables(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Retorna o quadro longo (df_unified) e o quadro de evolução (df_evol), ordenados pelos códigos das categorias."""
+        taxpayers, years, matrix, filled = self.build()
+        order = taxpayers.sort_values(['SigMun', 'MUNICIPIO', 'InscEst', 'CPF_CNPJ', 'RazSoc']).index.to_numpy()
+        taxpayers, matrix, filled = taxpayers.iloc[order].reset_index(drop=True), matrix[order], filled[order]
+
+        df_evol = pd.concat([taxpayers, pd.DataFrame(matrix, columns=[str(year) for year in years])], axis=1)
+
+        # Apenas as células informadas por algum arquivo; a ordem linha a linha já é contribuinte → ano
+        row_idx, year_idx = np.nonzero(filled)
+        df_unified = taxpayers.iloc[row_idx].reset_index(drop=True)
+        df_unified['ANO'] = years[year_idx].astype('int16')
+        df_unified['VALOR'] = matrix[row_idx, year_idx]
+        return df_unified, df_evol
+
+    def memory_mb(self) -> float:
+        """Memória ocupada pela matriz (ou, antes de materializada, pelas células acumuladas), em MB."""
+        # Não força a materialização: a resolução das duplicatas é medida na própria etapa (remove_duplicates)
+        if self._built is None:
+            return sum(array.nbytes for cell in self._cells for array in cell) / 2**20
+        _, _, matrix, filled = self._built
+        return (matrix.nbytes + filled.nbytes) / 2**20